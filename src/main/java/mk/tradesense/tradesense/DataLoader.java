@@ -1,6 +1,7 @@
 package mk.tradesense.tradesense;
 
 import jakarta.annotation.PostConstruct;
+import jakarta.annotation.PreDestroy;
 import org.springframework.stereotype.Component;
 
 import java.io.BufferedReader;
@@ -8,6 +9,8 @@ import java.io.InputStreamReader;
 
 @Component
 public class DataLoader {
+    private Process process;
+
     @PostConstruct
     public void init() {
         try {
@@ -17,22 +20,35 @@ public class DataLoader {
                 throw new IllegalStateException("PYTHON_PATH environment variable is not set");
             }
 
-            ProcessBuilder processBuilder = new ProcessBuilder(pythonPath, "src/main/java/mk/tradesense/tradesense/scripts/data_scraper_v4.py");
+            // Start the long-lived scraper daemon; it refreshes on a schedule and
+            // serves POST /refresh and GET /status, so startup does not wait on scraping
+            ProcessBuilder processBuilder = new ProcessBuilder(pythonPath, "-u", "src/main/java/mk/tradesense/tradesense/scripts/scraper_daemon.py");
             processBuilder.redirectErrorStream(true);
-            Process process = processBuilder.start();
+            process = processBuilder.start();
 
-            // Capture and print the output from the script
-            try (BufferedReader reader = new BufferedReader(new InputStreamReader(process.getInputStream()))) {
-                String line;
-                while ((line = reader.readLine()) != null) {
-                    System.out.println(line);
+            // Capture and print the output from the daemon in the background
+            Thread outputThread = new Thread(() -> {
+                try (BufferedReader reader = new BufferedReader(new InputStreamReader(process.getInputStream()))) {
+                    String line;
+                    while ((line = reader.readLine()) != null) {
+                        System.out.println(line);
+                    }
+                    System.out.println("Scraper daemon exited with code: " + process.waitFor());
+                } catch (Exception e) {
+                    e.printStackTrace();
                 }
-            }
-
-            int exitCode = process.waitFor();
-            System.out.println("Python script exited with code: " + exitCode);
+            }, "scraper-daemon-output");
+            outputThread.setDaemon(true);
+            outputThread.start();
         } catch (Exception e) {
             e.printStackTrace();
         }
     }
+
+    @PreDestroy
+    public void shutdown() {
+        if (process != null && process.isAlive()) {
+            process.destroy();
+        }
+    }
 }
@@ -8,7 +8,8 @@ import java.time.LocalDate;
 
 @Data
 @Entity
-@Table(name = "stock_items")
+@Table(name = "stock_items", uniqueConstraints = @UniqueConstraint(
+        name = "stock_items_stock_code_date_key", columnNames = {"stock_code", "date"}))
 public class StockPrice {
     @Id
     @GeneratedValue(strategy = GenerationType.IDENTITY)
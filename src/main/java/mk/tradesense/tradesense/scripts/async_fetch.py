@@ -0,0 +1,114 @@
+import asyncio
+import os
+import random
+import time
+
+import aiohttp
+
+from data_scraper_v4 import base_url, build_payload, parse_issuer_data, parse_issuers
+from http_session import BACKOFF_BASE, BACKOFF_MAX, MAX_RETRIES, FetchError, is_retryable_status
+
+# Async counterpart of get_issuers/fetch_issuer_data: every request runs as a
+# coroutine on one event loop and shares a single keep-alive connection pool,
+# so hundreds of requests can be outstanding without one thread per request.
+# Error statuses raise like http_session: 5xx, 429, timeouts and connection
+# errors are retried with jittered backoff, then raise FetchError. Pages are
+# parsed in the loop's default thread pool so parsing never stalls the loop.
+
+DEFAULT_CONCURRENCY = int(os.getenv("SCRAPER_ASYNC_CONCURRENCY", "200"))
+
+
+def create_session(concurrency=DEFAULT_CONCURRENCY, timeout=120):
+    connector = aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=30)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout))
+
+
+async def request_text(session, method, url, max_retries=MAX_RETRIES, **kwargs):
+    for attempt in range(max_retries + 1):
+        try:
+            async with session.request(method, url, **kwargs) as response:
+                response.raise_for_status()
+                return await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            status = isinstance(e, aiohttp.ClientResponseError)
+            if (status and not is_retryable_status(e.status)) or attempt == max_retries:
+                error = f"{e.status} {e.message}" if status else repr(e)
+                raise FetchError(f"{method} {url} failed after {attempt + 1} attempts: {error}") from e
+        await asyncio.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+
+
+async def get_issuers(session):
+    html = await request_text(session, "GET", f"{base_url}kmb")
+    return await asyncio.get_running_loop().run_in_executor(None, parse_issuers, html)
+
+
+async def fetch_issuer_data(session, issuer, start_date, end_date):
+    url = f"{base_url}{issuer}"
+    html = await request_text(session, "POST", url, data=build_payload(issuer, start_date, end_date))
+    return await asyncio.get_running_loop().run_in_executor(None, parse_issuer_data, issuer, html)
+
+
+class AsyncFetchEngine:
+    # Same contract as FetchScheduler.run, but `concurrency` coroutines pull
+    # units from the shared iterator instead of threads.
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, session=None):
+        self.concurrency = concurrency
+        self.session = session
+        self.completed = 0
+        self.failed = []
+        self.started_at = None
+        self.finished_at = None
+
+    async def _worker(self, session, units, results):
+        for unit in units:
+            try:
+                result = await fetch_issuer_data(session, *unit)
+            except Exception as e:
+                print(f"Error fetching data for {unit[0]} from {unit[1]} to {unit[2]}: {e}")
+                self.failed.append(unit)
+                continue
+            await results.put((unit, result))
+
+    async def run(self, units):
+        self.started_at = time.time()
+        units = iter(units)
+        results = asyncio.Queue(maxsize=self.concurrency)
+        session = self.session or create_session(self.concurrency)
+        workers = [asyncio.create_task(self._worker(session, units, results)) for _ in range(self.concurrency)]
+        done = asyncio.gather(*workers)
+        try:
+            while not (done.done() and results.empty()):
+                getter = asyncio.ensure_future(results.get())
+                await asyncio.wait([getter, done], return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    continue
+                self.completed += 1
+                yield getter.result()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if self.session is None:
+                await session.close()
+            self.finished_at = time.time()
+
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def throughput(self):
+        elapsed = self.elapsed()
+        return self.completed / elapsed if elapsed else 0.0
+
+    def report(self):
+        return (f"Fetched {self.completed} units ({len(self.failed)} failed) in {self.elapsed():.2f} seconds "
+                f"({self.throughput():.2f} units/s)")
+
+
+async def fetch_all(units, concurrency=DEFAULT_CONCURRENCY):
+    engine = AsyncFetchEngine(concurrency)
+    results = [item async for item in engine.run(units)]
+    print(engine.report())
+    return results
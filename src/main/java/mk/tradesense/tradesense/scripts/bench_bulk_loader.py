@@ -0,0 +1,76 @@
+import argparse
+import time
+from datetime import date, timedelta
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+import stand_in_server
+from bulk_loader import CopySink, STOCK_COLUMNS
+from data_scraper_v4 import DB_CONFIG
+
+# Rows/s of the execute_values path (one INSERT and commit per issuer-year
+# chunk, as main used to do) against CopySink, on a temporary copy of the
+# stock_items layout in the database configured in .env.
+
+BENCH_TABLE = "bench_stock_items"
+
+
+def generate_chunks(issuers, years):
+    end_date = date(2024, 12, 31)
+    chunks = []
+    for issuer in stand_in_server.issuer_codes(issuers):
+        for i in range(years):
+            range_end = end_date - timedelta(days=365 * i)
+            rows = stand_in_server.generate_rows(issuer, range_end - timedelta(days=364), range_end)
+            chunks.append([(issuer, *(cell or None for cell in row)) for row in rows])
+    return chunks
+
+
+def create_table(conn):
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+        cur.execute(f"CREATE TEMP TABLE {BENCH_TABLE} ({', '.join(f'{column} TEXT' for column in STOCK_COLUMNS)})")
+    conn.commit()
+
+
+def run_execute_values(conn, chunks):
+    insert_query = f"INSERT INTO {BENCH_TABLE} ({', '.join(STOCK_COLUMNS)}) VALUES %s"
+    for chunk in chunks:
+        with conn.cursor() as cur:
+            execute_values(cur, insert_query, chunk)
+        conn.commit()
+
+
+def run_copy(conn, chunks, max_rows):
+    with CopySink(conn, table=BENCH_TABLE, max_rows=max_rows) as sink:
+        for chunk in chunks:
+            sink.add(chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="execute_values vs COPY insert throughput on local Postgres")
+    parser.add_argument("--issuers", type=int, default=20)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--batch-rows", type=int, default=50000)
+    args = parser.parse_args()
+
+    chunks = generate_chunks(args.issuers, args.years)
+    row_count = sum(len(chunk) for chunk in chunks)
+    print(f"{row_count} rows in {len(chunks)} issuer-year chunks")
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        for name, run in (("execute_values", lambda: run_execute_values(conn, chunks)),
+                          ("copy", lambda: run_copy(conn, chunks, args.batch_rows))):
+            create_table(conn)
+            start_time = time.perf_counter()
+            run()
+            elapsed_time = time.perf_counter() - start_time
+            print(f"{name:<16} {elapsed_time:8.2f}s {row_count / elapsed_time:12,.0f} rows/s")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
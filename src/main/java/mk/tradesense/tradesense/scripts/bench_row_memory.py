@@ -0,0 +1,48 @@
+import argparse
+import tracemalloc
+from datetime import date, timedelta
+
+import stand_in_server
+from stock_row import COLUMN_LABELS, STOCK_COLUMNS, row_from_cells
+
+# tracemalloc peak of holding a 10-year backfill as the old per-row dicts
+# keyed by Cyrillic labels versus StockRow tuples. Cell strings are built
+# before tracing starts, so only the per-row container overhead is compared.
+
+LABELS = [COLUMN_LABELS[column] for column in STOCK_COLUMNS]
+
+
+def build_dicts(pages):
+    return [dict(zip(LABELS, (issuer, *(cell or None for cell in cells)))) for issuer, rows in pages for cells in rows]
+
+
+def build_rows(pages):
+    return [row_from_cells(issuer, cells) for issuer, rows in pages for cells in rows]
+
+
+def measure(build, pages):
+    tracemalloc.start()
+    rows = build(pages)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(rows), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak memory of dict rows vs StockRow for a full backfill")
+    parser.add_argument("--issuers", type=int, default=50)
+    parser.add_argument("--years", type=int, default=10)
+    args = parser.parse_args()
+
+    end_date = date(2024, 12, 31)
+    start_date = end_date - timedelta(days=365 * args.years - 1)
+    pages = [(issuer, stand_in_server.generate_rows(issuer, start_date, end_date))
+             for issuer in stand_in_server.issuer_codes(args.issuers)]
+
+    for name, build in (("dict", build_dicts), ("StockRow", build_rows)):
+        row_count, peak = measure(build, pages)
+        print(f"{name:<10} {row_count:>9} rows {peak / 1024 / 1024:8.1f} MiB peak {peak / row_count:8.0f} bytes/row")
+
+
+if __name__ == "__main__":
+    main()
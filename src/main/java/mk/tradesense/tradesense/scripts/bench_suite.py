@@ -0,0 +1,451 @@
+import argparse
+import glob
+import gzip
+import json
+import math
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import partial
+
+import stand_in_server
+from gap_fill import forward_fill_data
+from normalizer import normalize_records
+from parse_pool import CPU_COUNT, ParsePool
+from stock_row import STOCK_COLUMNS, row_from_cells, to_labeled_dict
+from table_parser import BACKENDS, parse_results_table
+
+# Offline benchmark of every scraper stage on symbolhistory pages stored in
+# fixtures/symbolhistory: parse rows/s per backend and through the process
+# pool at 1 worker and one per core, normalization rows/s (the v1-v3
+# per-cell code against normalizer), in-memory forward fill (the old
+# day-by-day loop against gap_fill), and with --db the insert, the ingest
+# pipeline at 1 to 8 writer connections, the set-based forward fill and
+# reading history back (fetchall against history_reader) against the
+# Postgres configured in .env. Before anything is timed, every parser
+# backend is checked against bs4 on each page (the stream backend also on
+# the malformed pages in EDGE_CASES) and normalizer and gap_fill against the
+# code they replaced, so a faster path can never silently change what gets
+# stored. Results are saved as JSON; with --baseline every rows/s figure of
+# the code the scrapers run is compared with a stored run and the suite
+# exits 1 if any dropped by more than --tolerance. The replaced code in
+# REFERENCE_BENCHMARKS is timed for comparison only and never fails it.
+#
+# The committed fixtures are synthetic: stand_in_server renders a
+# #resultsTable of nine cells a row inside a small page of its own, not the
+# live markup, so parse figures on them are for comparing runs, not for
+# predicting the live scraper. --record ISSUER replaces them with real pages, named after
+# the issuer, so results on the two are never compared with each other.
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "symbolhistory")
+FIXTURE_DAYS = (30, 365, 3650)
+FIXTURE_END_DATE = date(2024, 12, 31)
+TOLERANCE = 0.2
+ROUNDS = 5
+WRITER_COUNTS = (1, 2, 4, 8)
+WRITER_ISSUERS = 64
+WRITER_BATCH_ROWS = 5000
+# Code the scrapers no longer run, kept as the yardstick
+REFERENCE_BENCHMARKS = ("parse/bs4/", "normalize/per-cell/", "forward_fill/day-by-day/",
+                        "insert/execute_values/", "read/fetchall/")
+
+ROW = "<tr>" + "<td>1</td>" * 9 + "</tr>"
+EDGE_CASES = {
+    # Without a tbody of its own, no other table's rows belong to it
+    "resultsTable without tbody": f'<table id="resultsTable">{ROW}</table><table><tbody>{ROW}</tbody></table>',
+    # Nested table rows and cells count too, as in find_all
+    "nested table in a cell": ('<table id="resultsTable"><tbody><tr><td><table><tr><td>inner</td></tr></table>'
+                               'outer</td>' + "<td>2</td>" * 8 + "</tr></tbody></table>"),
+    # An unclosed <td> contains the cells after it
+    "unclosed td": '<table id="resultsTable"><tbody><tr>' + "<td>3" * 9 + "</tr></tbody></table>",
+    # The id sits on the tbody itself, which is not inside #resultsTable
+    "id on the tbody": f'<table><tbody id="resultsTable">{ROW}</tbody></table>',
+    # A stray end tag closes the table early
+    "table closed by an outer end tag": f'<div><table id="resultsTable"></div><tbody>{ROW}</tbody></table>',
+}
+
+
+def legacy_format(stock_data):
+    # insert_data_to_db of data_scraper_v2/v3 before normalizer
+    stock_data = sorted(stock_data, key=lambda x: (
+        x['Издавач'], datetime.strptime(x['Датум'], "%d.%m.%Y") if x['Датум'] else datetime.min))
+    return [
+        (
+            record['Издавач'],
+            datetime.strptime(record['Датум'], "%d.%m.%Y") if record['Датум'] else None,
+            float(record['Цена на последна трансакција'].replace('.', '').replace(',', '.')) if record[
+                'Цена на последна трансакција'] else None,
+            float(record['Макс.'].replace('.', '').replace(',', '.')) if record['Макс.'] else None,
+            float(record['Мин.'].replace('.', '').replace(',', '.')) if record['Мин.'] else None,
+            float(record['Просечна цена'].replace('.', '').replace(',', '.')) if record['Просечна цена'] else None,
+            float(record['% пром.'].replace('.', '').replace(',', '.')) if record['% пром.'] else 0,
+            float(record['Количина'].replace('.', '').replace(',', '.')) if record['Количина'] else None,
+            float(record['Промет во БЕСТ во денари'].replace('.', '').replace(',', '.')) if record[
+                'Промет во БЕСТ во денари'] else None,
+            float(record['Вкупен промет во денари'].replace('.', '').replace(',', '.')) if record[
+                'Вкупен промет во денари'] else None
+        )
+        for record in stock_data
+    ]
+
+
+def legacy_forward_fill_data(stock_data_sorted):
+    # forward_fill_data of data_scraper_v2/v3 before gap_fill
+    filled_data = []
+
+    stock_data_sorted = sorted(stock_data_sorted, key=lambda x: (
+    x.stock_code, datetime.strptime(x.date, "%d.%m.%Y") if x.date else datetime.min))
+
+    grouped_by_issuer = {}
+    for record in stock_data_sorted:
+        issuer = record.stock_code
+        if issuer not in grouped_by_issuer:
+            grouped_by_issuer[issuer] = []
+        grouped_by_issuer[issuer].append(record)
+
+    for issuer, records in grouped_by_issuer.items():
+        records = sorted(records, key=lambda x: datetime.strptime(x.date, "%d.%m.%Y"))
+
+        for i in range(len(records) - 1):
+            current_record = records[i]
+            next_record = records[i + 1]
+
+            current_date = datetime.strptime(current_record.date, "%d.%m.%Y")
+            next_date = datetime.strptime(next_record.date, "%d.%m.%Y")
+            while (next_date - current_date).days > 1:
+                current_date += timedelta(days=1)
+                filled_data.append(current_record._replace(
+                    date=current_date.strftime("%d.%m.%Y"),
+                    percent_change='0',
+                    quantity='0',
+                    turnover_best='0',
+                    total_turnover='0'
+                ))
+
+        filled_data.extend(records)
+
+    return filled_data
+
+
+def same_normalized_rows(expected, actual):
+    # legacy_format keeps datetimes and floats, normalizer dates and close floats
+    if len(expected) != len(actual):
+        return False
+    for expected_row, actual_row in zip(expected, actual):
+        if expected_row[0] != actual_row[0] or expected_row[1].date() != actual_row[1]:
+            return False
+        for a, b in zip(expected_row[2:], actual_row[2:]):
+            if (a is None) != (b is None) or (a is not None and not math.isclose(a, b)):
+                return False
+    return True
+
+
+def check_outputs(fixtures, records):
+    for name, html in fixtures.items():
+        expected = BACKENDS["bs4"](html)
+        for backend, parse_rows in sorted(BACKENDS.items()):
+            if parse_rows(html) != expected:
+                raise SystemExit(f"{backend} output differs from bs4 on {name}")
+    for name, html in EDGE_CASES.items():
+        if BACKENDS["stream"](html) != BACKENDS["bs4"](html):
+            raise SystemExit(f"stream output differs from bs4 on {name}")
+    for name, rows in records.items():
+        if not same_normalized_rows(legacy_format([to_labeled_dict(row) for row in rows]), normalize_records(rows)):
+            raise SystemExit(f"normalize_records output differs from the per-cell code on {name}")
+        if forward_fill_data(rows) != legacy_forward_fill_data(rows):
+            raise SystemExit(f"forward_fill_data output differs from the day-by-day loop on {name}")
+
+
+def fixture_path(directory, source, days):
+    return os.path.join(directory, f"{source}-{days}d.html.gz")
+
+
+def clear_fixtures(directory):
+    for path in glob.glob(os.path.join(directory, "*.html.gz")):
+        os.remove(path)
+
+
+def write_fixture(path, html):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # mtime=0 keeps regenerated fixtures byte-identical
+    with open(path, "wb") as f, gzip.GzipFile(fileobj=f, mode="wb", mtime=0) as fixture:
+        fixture.write(html.encode("utf-8"))
+
+
+def generate_fixtures(directory, days_list=FIXTURE_DAYS):
+    clear_fixtures(directory)
+    for days in days_list:
+        rows = stand_in_server.generate_rows("BENCH", FIXTURE_END_DATE - timedelta(days=days - 1), FIXTURE_END_DATE)
+        write_fixture(fixture_path(directory, "synthetic", days), stand_in_server.render_symbolhistory_page(rows))
+
+
+def record_fixtures(directory, issuer, days_list=FIXTURE_DAYS):
+    # Real pages from MSE_BASE_URL, fetched once and stored as fixtures
+    from data_scraper_v4 import base_url, build_payload
+    from http_session import get_session
+
+    end_date = date.today() - timedelta(days=1)
+    clear_fixtures(directory)
+    for days in days_list:
+        payload = build_payload(issuer, end_date - timedelta(days=days - 1), end_date)
+        response = get_session().post(f"{base_url}{issuer}", data=payload)
+        write_fixture(fixture_path(directory, issuer, days), response.text)
+
+
+def load_fixtures(directory):
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.html.gz"))):
+        with gzip.open(path, "rt", encoding="utf-8") as fixture:
+            fixtures[os.path.basename(path)[:-len(".html.gz")]] = fixture.read()
+    return fixtures
+
+
+def fixture_records(fixtures):
+    return {name: [row_from_cells("BENCH", cells) for cells in parse_results_table(html)]
+            for name, html in fixtures.items()}
+
+
+def rows_per_second(function, argument, row_count, min_time, rounds=ROUNDS):
+    # Best of several rounds, which is far steadier than the mean on a busy machine
+    best = 0.0
+    for _ in range(rounds):
+        runs = 0
+        start_time = time.perf_counter()
+        while True:
+            function(argument)
+            runs += 1
+            elapsed_time = time.perf_counter() - start_time
+            if elapsed_time >= min_time / rounds:
+                break
+        best = max(best, row_count * runs / elapsed_time)
+    return best
+
+
+def bench_parse(fixtures, min_time):
+    results = {}
+    for name, html in fixtures.items():
+        row_count = len(BACKENDS["bs4"](html))
+        for backend, parse_rows in sorted(BACKENDS.items()):
+            results[f"parse/{backend}/{name}"] = rows_per_second(parse_rows, html, row_count, min_time)
+    return results
+
+
+def bench_parse_pool(fixtures, min_time):
+    # Two feeding threads per worker keep every worker busy
+    results = {}
+    for workers in sorted({1, CPU_COUNT}):
+        with ParsePool(workers) as pool, ThreadPoolExecutor(workers * 2) as threads:
+            def parse_pages(pages):
+                return list(threads.map(lambda page: pool.parse("BENCH", page), pages))
+
+            for name, html in fixtures.items():
+                pages = [html.encode("utf-8")] * (workers * 2)
+                row_count = sum(len(rows) for rows in parse_pages(pages))
+                results[f"parse_pool/{workers}w/{name}"] = rows_per_second(parse_pages, pages, row_count, min_time)
+    return results
+
+
+def bench_normalize(records, min_time):
+    results = {}
+    for name, rows in records.items():
+        labeled_rows = [to_labeled_dict(row) for row in rows]
+        results[f"normalize/per-cell/{name}"] = rows_per_second(legacy_format, labeled_rows, len(rows), min_time)
+        results[f"normalize/vectorized/{name}"] = rows_per_second(normalize_records, rows, len(rows), min_time)
+    return results
+
+
+def bench_forward_fill(records, min_time):
+    # Throughput in filled output rows, the work both versions scale with
+    results = {}
+    for name, rows in records.items():
+        output_rows = len(forward_fill_data(rows))
+        results[f"forward_fill/day-by-day/{name}"] = rows_per_second(
+            legacy_forward_fill_data, rows, output_rows, min_time)
+        results[f"forward_fill/vectorized/{name}"] = rows_per_second(forward_fill_data, rows, output_rows, min_time)
+    return results
+
+
+def bench_db(records):
+    # One timed pass per case: each needs a fresh temporary table
+    import psycopg2
+    from psycopg2.extras import execute_values
+
+    from bulk_loader import CopySink
+    from data_scraper_v4 import DB_CONFIG
+    from gap_fill import FILL_COLUMNS, forward_fill_table
+    from history_reader import iter_history
+
+    results = {}
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        for name, rows in records.items():
+            for method in ("execute_values", "copy"):
+                with conn.cursor() as cur:
+                    cur.execute("DROP TABLE IF EXISTS bench_stock_items")
+                    cur.execute(f"CREATE TEMP TABLE bench_stock_items "
+                                f"({', '.join(f'{column} TEXT' for column in STOCK_COLUMNS)})")
+                conn.commit()
+                start_time = time.perf_counter()
+                if method == "copy":
+                    with CopySink(conn, table="bench_stock_items") as sink:
+                        sink.add(rows)
+                else:
+                    with conn.cursor() as cur:
+                        execute_values(cur, f"INSERT INTO bench_stock_items ({', '.join(STOCK_COLUMNS)}) VALUES %s",
+                                       rows)
+                    conn.commit()
+                results[f"insert/{method}/{name}"] = len(rows) / (time.perf_counter() - start_time)
+
+            # The watermark table is created first as TEMP so the fill creates nothing permanent
+            with conn.cursor() as cur:
+                cur.execute("DROP TABLE IF EXISTS bench_stock_prices, bench_stock_prices_fill_watermarks")
+                cur.execute(f"CREATE TEMP TABLE bench_stock_prices (stock_code VARCHAR(255), date DATE, "
+                            f"{', '.join(f'{column} NUMERIC' for column in FILL_COLUMNS)})")
+                cur.execute("CREATE TEMP TABLE bench_stock_prices_fill_watermarks "
+                            "(stock_code VARCHAR(255) PRIMARY KEY, filled_through DATE NOT NULL)")
+                execute_values(cur, f"INSERT INTO bench_stock_prices (stock_code, date, {', '.join(FILL_COLUMNS)}) "
+                                    f"VALUES %s", normalize_records(rows))
+            conn.commit()
+            start_time = time.perf_counter()
+            filled_rows = sum(forward_fill_table(conn, incremental=False, table="bench_stock_prices").values())
+            results[f"forward_fill_db/set-based/{name}"] = (
+                (len(rows) + filled_rows) / (time.perf_counter() - start_time))
+
+            # Reading the filled table back: tuples per row against typed chunks
+            start_time = time.perf_counter()
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT stock_code, date, {', '.join(FILL_COLUMNS)} FROM bench_stock_prices "
+                            f"ORDER BY stock_code, date")
+                read_rows = len(cur.fetchall())
+            results[f"read/fetchall/{name}"] = read_rows / (time.perf_counter() - start_time)
+            start_time = time.perf_counter()
+            read_rows = sum(len(batch["date"]) for batch in iter_history(conn, "bench_stock_prices"))
+            results[f"read/history_reader/{name}"] = read_rows / (time.perf_counter() - start_time)
+            conn.commit()
+    finally:
+        conn.close()
+    return results
+
+
+def bench_writers(records):
+    # The largest fixture copied to WRITER_ISSUERS issuers and written through
+    # IngestPipeline. The table is a regular one, which every writer
+    # connection can see, dropped afterwards.
+    import psycopg2
+    from psycopg2.pool import ThreadedConnectionPool
+
+    from bulk_loader import CopySink
+    from data_scraper_v4 import DB_CONFIG
+    from ingest_pipeline import IngestPipeline
+
+    name, rows = max(records.items(), key=lambda item: len(item[1]))
+    batches = [[row._replace(stock_code=f"B{issuer:03d}") for row in rows] for issuer in range(WRITER_ISSUERS)]
+    row_count = sum(len(batch) for batch in batches)
+    sink_factory = partial(CopySink, table="bench_ingest_items", max_rows=WRITER_BATCH_ROWS)
+
+    results = {}
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        for writers in WRITER_COUNTS:
+            with conn.cursor() as cur:
+                cur.execute("DROP TABLE IF EXISTS bench_ingest_items")
+                cur.execute(f"CREATE TABLE bench_ingest_items "
+                            f"({', '.join(f'{column} TEXT' for column in STOCK_COLUMNS)})")
+            conn.commit()
+            # Every connection is opened before the clock starts
+            pool = ThreadedConnectionPool(writers, writers, **DB_CONFIG)
+            try:
+                start_time = time.perf_counter()
+                with IngestPipeline(pool, sink_factory, writers) as pipeline:
+                    for batch in batches:
+                        pipeline.put(batch)
+                results[f"insert/pipeline-{writers}w/{name}x{WRITER_ISSUERS}"] = (
+                    row_count / (time.perf_counter() - start_time))
+            finally:
+                pool.closeall()
+        with conn.cursor() as cur:
+            cur.execute("DROP TABLE IF EXISTS bench_ingest_items")
+        conn.commit()
+    finally:
+        conn.close()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Only the code the scrapers run can fail the comparison
+    regressions = []
+    print(f"{'benchmark':<52} {'baseline':>12} {'current':>12} {'change':>8}")
+    for key in sorted(results):
+        if key not in baseline:
+            print(f"{key:<52} {'-':>12} {results[key]:>12,.0f}")
+            continue
+        change = results[key] / baseline[key] - 1
+        flag = ""
+        if key.startswith(REFERENCE_BENCHMARKS):
+            flag = "  (reference)"
+        elif change < -tolerance:
+            regressions.append(key)
+            flag = "  REGRESSION"
+        print(f"{key:<52} {baseline[key]:>12,.0f} {results[key]:>12,.0f} {change:>+8.0%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline rows/s benchmark of every scraper stage")
+    parser.add_argument("--fixtures", default=FIXTURE_DIR, help="directory of *.html.gz symbolhistory pages")
+    parser.add_argument("--min-time", type=float, default=1.0, help="seconds to repeat each in-memory benchmark")
+    parser.add_argument("--db", action="store_true", help="also benchmark inserts and the DB forward fill")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare with; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed rows/s drop, 0.2 = 20%%")
+    parser.add_argument("--record", metavar="ISSUER", help="replace the fixtures with real pages for ISSUER and exit")
+    parser.add_argument("--generate", action="store_true", help="regenerate the synthetic fixtures and exit")
+    args = parser.parse_args()
+
+    if args.record:
+        record_fixtures(args.fixtures, args.record)
+        return
+    if args.generate:
+        generate_fixtures(args.fixtures)
+        return
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        raise SystemExit(f"No fixtures in {args.fixtures}; run with --generate or --record ISSUER")
+    records = fixture_records(fixtures)
+    check_outputs(fixtures, records)
+
+    results = {}
+    results.update(bench_parse(fixtures, args.min_time))
+    results.update(bench_parse_pool(fixtures, args.min_time))
+    results.update(bench_normalize(records, args.min_time))
+    results.update(bench_forward_fill(records, args.min_time))
+    if args.db:
+        results.update(bench_db(records))
+        results.update(bench_writers(records))
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({
+                "time": time.time(),
+                "python": sys.version.split()[0],
+                "machine": platform.platform(),
+                "fixtures": {name: len(rows) for name, rows in records.items()},
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        raise SystemExit(f"{len(regressions)} benchmarks regressed by more than {args.tolerance:.0%}: "
+                         f"{', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
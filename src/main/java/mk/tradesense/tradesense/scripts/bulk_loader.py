@@ -0,0 +1,217 @@
+import io
+import os
+
+import metrics
+from stock_row import STOCK_COLUMNS
+
+# Streams rows into Postgres with COPY ... FROM STDIN instead of building
+# multi-row INSERT statements. Rows are buffered as COPY text in memory and
+# flushed, with one commit, whenever the batch reaches max_rows or max_bytes.
+# In upsert mode batches are copied into a staging table and merged on
+# (stock_code, date), so re-scraping an overlapping window never duplicates.
+# With a checkpoint journal, all rows of a unit go into one batch (which may
+# run past max_rows by up to a page) and the unit is marked done in that
+# batch's transaction, so a resumed run never copies half a unit twice, even
+# in append mode.
+
+UNIQUE_KEY = ("stock_code", "date")
+
+BATCH_ROWS = int(os.getenv("SCRAPER_BATCH_ROWS", "50000"))
+BATCH_BYTES = int(os.getenv("SCRAPER_BATCH_BYTES", str(16 * 1024 * 1024)))
+INGEST_MODE = os.getenv("SCRAPER_INGEST_MODE", "upsert")
+
+
+def copy_escape(value):
+    if value is None:
+        return "\\N"
+    # "10" loads into integer and numeric columns alike, "10.0" only into numeric
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value)
+    if "\\" in value or "\t" in value or "\n" in value or "\r" in value:
+        value = value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+    return value
+
+
+def format_copy_row(row):
+    return "\t".join(map(copy_escape, row)) + "\n"
+
+
+class CopySink:
+    def __init__(self, conn, table="stock_items", columns=STOCK_COLUMNS, max_rows=BATCH_ROWS, max_bytes=BATCH_BYTES,
+                 journal=None):
+        self.conn = conn
+        self.table = table
+        self.columns = columns
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.copy_query = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+        self.buffer = io.StringIO()
+        self.buffered_rows = 0
+        self.buffered_bytes = 0
+        self.rows_written = 0
+        self.batches = 0
+        self.journal = journal
+        self.buffered_units = []
+
+    def add(self, rows, unit=None):
+        # unit: the (issuer, start_date, end_date) these are all the rows of
+        journaled = unit is not None and self.journal is not None
+        for row in rows:
+            line = format_copy_row(row)
+            self.buffer.write(line)
+            self.buffered_rows += 1
+            self.buffered_bytes += len(line)
+            if not journaled and self.is_full():
+                self.flush()
+        if journaled:
+            self.buffered_units.append((*unit, len(rows)))
+            if self.is_full():
+                self.flush()
+
+    def is_full(self):
+        return self.buffered_rows >= self.max_rows or self.buffered_bytes >= self.max_bytes
+
+    def write_batch(self, cur):
+        cur.copy_expert(self.copy_query, self.buffer)
+
+    def batch_committed(self):
+        pass
+
+    def flush(self):
+        if not self.buffered_rows and not self.buffered_units:
+            return
+        self.buffer.seek(0)
+        try:
+            with metrics.timed("insert"):
+                with self.conn.cursor() as cur:
+                    if self.buffered_rows:
+                        self.write_batch(cur)
+                    if self.buffered_units:
+                        self.journal.mark_done(cur, self.buffered_units)
+                self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            self.buffer = io.StringIO()
+            self.buffered_units = []
+        if not self.buffered_rows:
+            return
+        self.rows_written += self.buffered_rows
+        metrics.add_rows("inserted", self.buffered_rows)
+        self.batches += 1
+        self.buffered_rows = 0
+        self.buffered_bytes = 0
+        self.batch_committed()
+
+    def report(self):
+        return f"Copied {self.rows_written} rows into {self.table} in {self.batches} batches"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+
+
+def has_unique_key(cur, table, key):
+    # Any valid, non-partial unique index on exactly these columns will do
+    # for ON CONFLICT, whatever created it (JPA, an earlier run, by hand)
+    cur.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_index i
+            WHERE i.indrelid = to_regclass(%s) AND i.indisunique AND i.indisvalid
+              AND i.indpred IS NULL AND i.indexprs IS NULL
+              AND (SELECT array_agg(a.attname::text ORDER BY a.attname::text) FROM pg_attribute a
+                   WHERE a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)) = %s::text[]
+        )
+    """, (table, sorted(key)))
+    return cur.fetchone()[0]
+
+
+def ensure_unique_key(conn, table="stock_items", key=UNIQUE_KEY):
+    index_name = f"{table}_{'_'.join(key)}_key"
+    with conn.cursor() as cur:
+        if has_unique_key(cur, table, key):
+            return
+        # Rows duplicated by earlier append-only runs would block the index.
+        cur.execute(f"""
+            DELETE FROM {table} a USING {table} b
+            WHERE {' AND '.join(f'a.{column} = b.{column}' for column in key)} AND a.id > b.id
+        """)
+        print(f"Removed {cur.rowcount} duplicate rows from {table}")
+        cur.execute(f"CREATE UNIQUE INDEX {index_name} ON {table} ({', '.join(key)})")
+    conn.commit()
+
+
+class UpsertSink(CopySink):
+    def __init__(self, conn, table="stock_items", columns=STOCK_COLUMNS, key=UNIQUE_KEY,
+                 max_rows=BATCH_ROWS, max_bytes=BATCH_BYTES, journal=None):
+        super().__init__(conn, table, columns, max_rows, max_bytes, journal)
+        self.stage_table = f"{table}_stage"
+        self.copy_query = f"COPY {self.stage_table} ({', '.join(columns)}) FROM STDIN"
+        column_list = ", ".join(columns)
+        key_list = ", ".join(key)
+        values = [column for column in columns if column not in key]
+        self.stage_query = f"""
+            CREATE TEMP TABLE IF NOT EXISTS {self.stage_table} ON COMMIT DELETE ROWS AS
+            SELECT {column_list} FROM {table} WITH NO DATA
+        """
+        # Only rows whose values actually changed are rewritten; xmax = 0
+        # tells freshly inserted rows apart from updated ones.
+        self.merge_query = f"""
+            WITH staged AS (
+                SELECT DISTINCT ON ({key_list}) {column_list}
+                FROM {self.stage_table}
+                ORDER BY {key_list}
+            ), merged AS (
+                INSERT INTO {table} ({column_list})
+                SELECT {column_list} FROM staged
+                ON CONFLICT ({key_list}) DO UPDATE SET
+                    {', '.join(f'{column} = EXCLUDED.{column}' for column in values)}
+                WHERE ({', '.join(f'{table}.{column}' for column in values)})
+                    IS DISTINCT FROM ({', '.join(f'EXCLUDED.{column}' for column in values)})
+                RETURNING (xmax = 0) AS inserted
+            )
+            SELECT (SELECT COUNT(*) FROM staged),
+                   COUNT(*) FILTER (WHERE inserted),
+                   COUNT(*) FILTER (WHERE NOT inserted)
+            FROM merged
+        """
+        self.batch_counts = (0, 0, 0)
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+
+    def write_batch(self, cur):
+        cur.execute(self.stage_query)
+        cur.copy_expert(self.copy_query, self.buffer)
+        cur.execute(self.merge_query)
+        staged, inserted, updated = cur.fetchone()
+        self.batch_counts = (inserted, updated, staged - inserted - updated)
+
+    def batch_committed(self):
+        inserted, updated, unchanged = self.batch_counts
+        self.inserted += inserted
+        self.updated += updated
+        self.unchanged += unchanged
+
+    def report(self):
+        return (f"Upserted {self.rows_written} rows into {self.table} in {self.batches} batches: "
+                f"{self.inserted} inserted, {self.updated} updated, {self.unchanged} unchanged")
+
+
+def prepare_ingest(conn, mode=INGEST_MODE):
+    # Run once per ingest, before any sink is created
+    if mode == "upsert":
+        ensure_unique_key(conn)
+
+
+def create_sink(conn, mode=INGEST_MODE, **kwargs):
+    if mode == "upsert":
+        return UpsertSink(conn, **kwargs)
+    if mode == "append":
+        return CopySink(conn, **kwargs)
+    raise ValueError(f"Unknown ingest mode {mode!r}, expected 'upsert' or 'append'")
@@ -0,0 +1,124 @@
+import threading
+
+from psycopg2.extras import execute_values
+
+# Durable record of the (issuer, start_date, end_date) units of a scrape.
+# Planned units are recorded as pending before fetching starts, and a writer
+# marks a unit done in the same transaction that commits its rows, so after
+# a crash the journal says exactly which ranges reached the database. The
+# next run schedules the pending units again, plans new ranges only after the
+# journaled ones, and clears the journal once nothing is left pending. While
+# some unit keeps failing, done units that end on or before their issuer's
+# last stored day are dropped after every run, since that watermark already
+# keeps them from being planned again; the journal never grows past the
+# units still pending and the ones ahead of the data.
+
+JOURNAL_TABLE = "scrape_journal"
+
+
+class CheckpointJournal:
+    def __init__(self, conn, table=JOURNAL_TABLE):
+        # conn is only used from the thread running the scrape and from
+        # split(), which is serialized by the lock
+        self.conn = conn
+        self.table = table
+        self.lock = threading.Lock()
+        self.pending = []
+        self.planned_through = {}
+        self.done_units = 0
+        self.done_rows = 0
+
+    def ensure_table(self):
+        with self.conn.cursor() as cur:
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    stock_code VARCHAR(255) NOT NULL,
+                    start_date DATE NOT NULL,
+                    end_date DATE NOT NULL,
+                    done_at TIMESTAMP,
+                    row_count INTEGER,
+                    PRIMARY KEY (stock_code, start_date, end_date)
+                )
+            """)
+        self.conn.commit()
+
+    def load(self):
+        # Pending units, the last journaled day per issuer, and what is done
+        with self.conn.cursor() as cur:
+            cur.execute(f"SELECT stock_code, start_date, end_date, done_at IS NOT NULL, row_count FROM {self.table}")
+            entries = cur.fetchall()
+        self.conn.commit()
+        self.pending = []
+        self.planned_through = {}
+        self.done_units = 0
+        self.done_rows = 0
+        for stock_code, start_date, end_date, done, row_count in entries:
+            if done:
+                self.done_units += 1
+                self.done_rows += row_count or 0
+            else:
+                self.pending.append((stock_code, start_date, end_date))
+            self.planned_through[stock_code] = max(end_date, self.planned_through.get(stock_code, end_date))
+        self.pending.sort()
+        return self.pending
+
+    def record(self, units):
+        with self.lock:
+            with self.conn.cursor() as cur:
+                execute_values(cur, f"""
+                    INSERT INTO {self.table} (stock_code, start_date, end_date) VALUES %s
+                    ON CONFLICT DO NOTHING
+                """, units)
+            self.conn.commit()
+
+    def split(self, unit, smaller_units):
+        # The smaller units replace the one that was split
+        with self.lock:
+            with self.conn.cursor() as cur:
+                cur.execute(f"DELETE FROM {self.table} WHERE stock_code = %s AND start_date = %s AND end_date = %s",
+                            unit)
+                execute_values(cur, f"""
+                    INSERT INTO {self.table} (stock_code, start_date, end_date) VALUES %s
+                    ON CONFLICT DO NOTHING
+                """, smaller_units)
+            self.conn.commit()
+
+    def mark_done(self, cur, units):
+        # Runs on the writer's cursor, inside the transaction of the rows;
+        # units are (stock_code, start_date, end_date, row_count)
+        execute_values(cur, f"""
+            INSERT INTO {self.table} (stock_code, start_date, end_date, done_at, row_count) VALUES %s
+            ON CONFLICT (stock_code, start_date, end_date) DO UPDATE SET
+                done_at = EXCLUDED.done_at, row_count = EXCLUDED.row_count
+        """, units, template="(%s, %s, %s, now(), %s)")
+
+    def clear_if_finished(self):
+        # Empties the journal once every unit is done, else drops the done
+        # units behind the stock_items watermark; returns the units still pending
+        with self.lock:
+            with self.conn.cursor() as cur:
+                cur.execute(f"SELECT COUNT(*) FROM {self.table} WHERE done_at IS NULL")
+                pending = cur.fetchone()[0]
+                if not pending:
+                    cur.execute(f"DELETE FROM {self.table}")
+                else:
+                    cur.execute(f"""
+                        DELETE FROM {self.table} journal
+                        USING (
+                            SELECT stock_code, MAX(TO_DATE(date, 'DD.MM.YYYY')) AS last_date
+                            FROM stock_items
+                            WHERE stock_code IN (SELECT stock_code FROM {self.table})
+                            GROUP BY stock_code
+                        ) watermarks
+                        WHERE journal.stock_code = watermarks.stock_code
+                          AND journal.done_at IS NOT NULL
+                          AND journal.end_date <= watermarks.last_date
+                    """)
+            self.conn.commit()
+        return pending
+
+    def report(self):
+        if not self.pending and not self.done_units:
+            return "Checkpoint journal: no interrupted scrape to resume"
+        return (f"Checkpoint journal: resuming {len(self.pending)} pending units, skipping {self.done_units} "
+                f"units ({self.done_rows} rows) already done")
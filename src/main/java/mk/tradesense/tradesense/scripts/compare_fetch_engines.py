@@ -0,0 +1,115 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import stand_in_server
+
+# Compares the thread-pool fetch path (FetchScheduler) with the asyncio engine
+# against a local stand-in server, reporting wall time, units/s, peak thread
+# count and peak Python heap for each. Both keep a fixed number of requests
+# in flight: the adaptive controller is pinned to --workers for the threads.
+# The heap is measured in a second run, as tracemalloc slows down the first.
+
+
+class ThreadSampler(threading.Thread):
+    def __init__(self, interval=0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = threading.active_count()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, threading.active_count())
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def build_units(issuers, years):
+    end_date = datetime.now().date()
+    units = []
+    for issuer in issuers:
+        for i in range(years):
+            range_end = end_date - timedelta(days=365 * i)
+            units.append((issuer, range_end - timedelta(days=364), range_end))
+    return units
+
+
+def measure(name, run):
+    sampler = ThreadSampler()
+    sampler.start()
+    start_time = time.time()
+    rows, report = run()
+    elapsed_time = time.time() - start_time
+    sampler.stop()
+    tracemalloc.start()
+    run()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<8} {elapsed_time:8.2f}s {rows:>10} rows {sampler.peak:>6} threads "
+          f"{peak_memory / 1024 / 1024:8.1f} MiB peak  | {report}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Thread pool vs asyncio fetch engine against a local stand-in")
+    parser.add_argument("--port", type=int, help="stand-in server port, a free one by default")
+    parser.add_argument("--issuers", type=int, default=40)
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--workers", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+
+    port = args.port or stand_in_server.free_port()
+    os.environ["MSE_BASE_URL"] = stand_in_server.base_url_for(port)
+    # The thread path would otherwise replay closed ranges from the response
+    # cache while asyncio always goes to the server
+    os.environ["SCRAPER_CACHE_MODE"] = "off"
+    # A fixed limit, so --workers is what the threads keep in flight
+    for setting in ("SCRAPER_CONCURRENCY_INITIAL", "SCRAPER_CONCURRENCY_MIN", "SCRAPER_CONCURRENCY_MAX",
+                    "SCRAPER_POOL_SIZE"):
+        os.environ[setting] = str(args.workers)
+    server = multiprocessing.Process(
+        target=stand_in_server.serve, args=(port, args.issuers, args.latency), daemon=True)
+    server.start()
+    time.sleep(1)
+
+    # Imported after the environment is set so both paths target the stand-in.
+    import async_fetch
+    import data_scraper_v4
+    from fetch_scheduler import FetchScheduler
+
+    units = build_units(stand_in_server.issuer_codes(args.issuers), args.years)
+    print(f"{len(units)} units, {args.latency:.2f}s server latency")
+
+    def run_threads():
+        scheduler = FetchScheduler(data_scraper_v4.fetch_issuer_data, max_workers=args.workers)
+        rows = sum(len(result or []) for _, result in scheduler.run(units))
+        return rows, scheduler.report()
+
+    def run_async():
+        async def consume():
+            engine = async_fetch.AsyncFetchEngine(args.concurrency)
+            rows = 0
+            async for _, result in engine.run(units):
+                rows += len(result or [])
+            return rows, engine.report()
+        return asyncio.run(consume())
+
+    try:
+        measure("threads", run_threads)
+        measure("asyncio", run_async)
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+
+# AIMD limit on in-flight HTTP requests, shared by every fetch thread. Each
+# request holds a slot from acquire() to release(); after every window of
+# completed requests the limit is re-evaluated:
+#   - any 429, an error rate more than ERROR_THRESHOLD (plus two standard
+#     errors of sampling noise) above the usual one, a moving average of
+#     earlier windows, or a p50 latency over LATENCY_FACTOR x the baseline
+#     (the p50 of windows run at no more than the first window's limit)
+#     cuts it by DECREASE. A steady share of 5xx or a long latency tail
+#     says nothing about load; only a rise over the usual does.
+#     simulate_controller.py checks both against modelled servers
+#   - otherwise, if the window actually filled the limit, it grows: doubling
+#     until the first cut (slow start), then by INCREASE_STEP
+# An optional MAX_RPS spaces request starts evenly. The current limit and the
+# last decisions are exposed through stats() and report().
+
+INITIAL_LIMIT = int(os.getenv("SCRAPER_CONCURRENCY_INITIAL", "8"))
+MIN_LIMIT = int(os.getenv("SCRAPER_CONCURRENCY_MIN", "2"))
+MAX_LIMIT = int(os.getenv("SCRAPER_CONCURRENCY_MAX", os.getenv("SCRAPER_POOL_SIZE", "50")))
+MAX_RPS = float(os.getenv("SCRAPER_MAX_RPS", "0"))
+LATENCY_FACTOR = 2.5
+ERROR_THRESHOLD = 0.05
+# Weight of the latest window in the usual error rate
+ERROR_SMOOTHING = 0.2
+DECREASE = 0.7
+INCREASE_STEP = 2
+WINDOW_SAMPLES = 20
+# Weight of the latest quiet window in the baseline latency
+BASELINE_SMOOTHING = 0.2
+
+OK = "ok"
+ERROR = "error"
+THROTTLED = "throttled"
+
+
+def outcome_for_status(status_code):
+    if status_code == 429:
+        return THROTTLED
+    if status_code >= 500:
+        return ERROR
+    return OK
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class ConcurrencyController:
+    def __init__(self, initial=INITIAL_LIMIT, min_limit=MIN_LIMIT, max_limit=MAX_LIMIT, max_rps=MAX_RPS,
+                 clock=time.monotonic):
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.limit = min(self.max_limit, max(min_limit, initial))
+        self.max_rps = max_rps
+        self.clock = clock
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.window_peak = 0
+        self.latencies = []
+        self.errors = 0
+        self.throttled = 0
+        self.baseline = None
+        self.baseline_limit = None
+        self.error_baseline = None
+        self.cut_at = 0.0
+        self.slow_start = True
+        self.next_start = 0.0
+        self.increases = 0
+        self.decreases = 0
+        self.decisions = deque(maxlen=50)
+
+    def acquire(self):
+        # Blocks until a slot is free (and the RPS ceiling allows a start);
+        # returns the start time to pass to release()
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+            self.window_peak = max(self.window_peak, self.in_flight)
+            delay = 0.0
+            if self.max_rps:
+                now = self.clock()
+                start = max(now, self.next_start)
+                self.next_start = start + 1.0 / self.max_rps
+                delay = start - now
+        if delay > 0:
+            time.sleep(delay)
+        return self.clock()
+
+    def release(self, started, outcome=OK):
+        latency = self.clock() - started
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+            # Requests sent before the last cut say nothing about the new limit
+            if started < self.cut_at:
+                return
+            self.latencies.append(latency)
+            if outcome == THROTTLED:
+                self.throttled += 1
+            elif outcome == ERROR:
+                self.errors += 1
+            if len(self.latencies) >= max(WINDOW_SAMPLES, self.limit):
+                self._adjust()
+
+    def _adjust(self):
+        latencies = sorted(self.latencies)
+        p50 = percentile(latencies, 0.5)
+        p95 = percentile(latencies, 0.95)
+        error_rate = self.errors / len(latencies)
+        usual_error_rate = self.error_baseline or 0.0
+        noise = 2 * math.sqrt(usual_error_rate * (1 - usual_error_rate) / len(latencies))
+        # Windows run at no more than the limit the baseline was first taken
+        # at are no busier than then; only they move it, so it keeps up with
+        # a server that became slower for good (the limit ends up back there)
+        # but not with the queueing a higher limit causes
+        if self.baseline is None:
+            self.baseline = p50
+            self.baseline_limit = self.limit
+        elif self.limit <= self.baseline_limit:
+            self.baseline += BASELINE_SMOOTHING * (p50 - self.baseline)
+
+        old_limit = self.limit
+        if self.throttled:
+            reason = f"{self.throttled} throttled (429)"
+        elif error_rate > usual_error_rate + ERROR_THRESHOLD + noise:
+            reason = f"error rate {error_rate:.0%} up from {usual_error_rate:.0%}"
+        elif p50 > self.baseline * LATENCY_FACTOR:
+            reason = f"p50 {p50:.2f}s over {LATENCY_FACTOR}x baseline {self.baseline:.2f}s"
+        else:
+            reason = None
+
+        if reason is not None:
+            self.limit = max(self.min_limit, int(self.limit * DECREASE))
+            self.slow_start = False
+            self.cut_at = self.clock()
+        elif self.window_peak >= self.limit:
+            growth = self.limit if self.slow_start else INCREASE_STEP
+            self.limit = min(self.max_limit, self.limit + growth)
+            reason = f"p95 {p95:.2f}s, error rate {error_rate:.0%}" + (" (slow start)" if self.slow_start else "")
+
+        if self.limit != old_limit:
+            if self.limit > old_limit:
+                self.increases += 1
+            else:
+                self.decreases += 1
+            self.decisions.append({
+                "time": time.time(), "from": old_limit, "to": self.limit, "reason": reason,
+                "p50": p50, "p95": p95, "error_rate": error_rate,
+            })
+
+        if self.error_baseline is None:
+            self.error_baseline = error_rate
+        else:
+            self.error_baseline += ERROR_SMOOTHING * (error_rate - self.error_baseline)
+        self.latencies = []
+        self.errors = 0
+        self.throttled = 0
+        self.window_peak = self.in_flight
+
+    def stats(self):
+        with self.condition:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "max_rps": self.max_rps,
+                "baseline_latency": self.baseline,
+                "baseline_error_rate": self.error_baseline,
+                "increases": self.increases,
+                "decreases": self.decreases,
+                "decisions": list(self.decisions),
+            }
+
+    def report(self):
+        stats = self.stats()
+        last = stats["decisions"][-1] if stats["decisions"] else None
+        line = (f"Concurrency: limit {stats['limit']} ({stats['min_limit']}-{stats['max_limit']}), "
+                f"{stats['increases']} increases, {stats['decreases']} decreases")
+        if last is not None:
+            line += f", last {last['from']} -> {last['to']}: {last['reason']}"
+        return line
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = ConcurrencyController()
+        return _controller
@@ -2,15 +2,20 @@ import requests
 from bs4 import BeautifulSoup
 from datetime import datetime, timedelta, date
 from concurrent.futures import ThreadPoolExecutor
-import pandas as pd
 import psycopg2
-from psycopg2.extras import execute_values
 import time
 import os
 from dotenv import load_dotenv
 # Load environment variables from the .env file
 load_dotenv()
 
+# Local modules read their settings from the environment at import time
+import metrics
+from bulk_loader import CopySink
+from gap_fill import forward_fill_table
+from normalizer import normalize_records
+from stock_row import row_from_cells
+
 # Database configuration using environment variables
 DB_CONFIG = {
     "dbname": os.getenv("DB_NAME"),
@@ -20,6 +25,9 @@ DB_CONFIG = {
     "port": os.getenv("DB_PORT")
 }
 
+# incremental (default) fills only days after each issuer's last filled date, full refills all history
+FILL_MODE = os.getenv("SCRAPER_FILL_MODE", "incremental")
+
 base_url = "https://www.mse.mk/mk/stats/symbolhistory/"
 issuers_data = []
 
@@ -28,7 +36,7 @@ def num_there(s):
 
 def get_issuers():
     issuers_url = f"{base_url}kmb"
-    with requests.Session() as session:
+    with metrics.timed("get_issuers"), requests.Session() as session:
         response = session.get(issuers_url)
         soup = BeautifulSoup(response.content, "html.parser")
         issuers_elements = soup.select("#Code option")
@@ -44,38 +52,10 @@ def get_last_scraped_date(conn):
         return result[0] if result[0] else None
 
 
-def insert_data_to_db(conn, stock_data):
-    insert_query = """
-        INSERT INTO stock_prices (
-            stock_code, date, last_price, max_price, min_price, avg_price,
-            percent_change, quantity, turnover_best, total_turnover
-        ) VALUES %s
-    """
-
-    # Convert numeric fields from strings to floats, handling commas and thousand separators
-    formatted_data = [
-        (
-            record['Издавач'],
-            datetime.strptime(record['Датум'], "%d.%m.%Y") if record['Датум'] else None,
-            float(record['Цена на последна трансакција'].replace(".", "").replace(",", ".")) if record[
-                'Цена на последна трансакција'] else None,
-            float(record['Макс.'].replace(".", "").replace(",", ".")) if record['Макс.'] else None,
-            float(record['Мин.'].replace(".", "").replace(",", ".")) if record['Мин.'] else None,
-            float(record['Просечна цена'].replace(".", "").replace(",", ".")) if record['Просечна цена'] else None,
-            float(record['% пром.'].replace(".", "").replace(",", ".")) if record['% пром.'] else 0,
-            float(record['Количина'].replace(".", "").replace(",", ".")) if record['Количина'] else None,
-            float(record['Промет во БЕСТ во денари'].replace(".", "").replace(",", ".")) if record[
-                'Промет во БЕСТ во денари'] else None,
-            float(record['Вкупен промет во денари'].replace(".", "").replace(",", ".")) if record[
-                'Вкупен промет во денари'] else None
-        )
-        for record in stock_data
-    ]
-
-    # Insert formatted data into the database
-    with conn.cursor() as cur:
-        execute_values(cur, insert_query, formatted_data)
-    conn.commit()
+def insert_data_to_db(sink, stock_data):
+    # Numbers and dates converted column-wise; the sink COPYs and commits
+    # them in large batches
+    sink.add(normalize_records(stock_data))
 
 def fetch_issuer_data(issuer, start_date, end_date):
     issuer_data = []
@@ -87,90 +67,31 @@ def fetch_issuer_data(issuer, start_date, end_date):
             "Issuer": issuer
         }
         try:
-            response = session.post(url, data=payload)
-            soup = BeautifulSoup(response.text, "html.parser")
-            table_body = soup.select_one("#resultsTable tbody")
-            if not table_body:
-                return []
-            for row in table_body.find_all("tr"):
-                row_data = row.find_all("td")
-                if len(row_data) < 9:
-                    continue
-                issuer_data.append({
-                    "Издавач": issuer,
-                    "Датум": row_data[0].text.strip() or None,
-                    "Цена на последна трансакција": row_data[1].text.strip() or None,
-                    "Макс.": row_data[2].text.strip() or None,
-                    "Мин.": row_data[3].text.strip() or None,
-                    "Просечна цена": row_data[4].text.strip() or None,
-                    "% пром.": row_data[5].text.strip() or None,
-                    "Количина": row_data[6].text.strip() or None,
-                    "Промет во БЕСТ во денари": row_data[7].text.strip() or None,
-                    "Вкупен промет во денари": row_data[8].text.strip() or None,
-                })
+            with metrics.timed("fetch"):
+                response = session.post(url, data=payload)
+            with metrics.timed("parse"):
+                soup = BeautifulSoup(response.text, "html.parser")
+                table_body = soup.select_one("#resultsTable tbody")
+                if not table_body:
+                    return []
+                for row in table_body.find_all("tr"):
+                    row_data = row.find_all("td")
+                    if len(row_data) < 9:
+                        continue
+                    issuer_data.append(row_from_cells(issuer, [cell.text.strip() for cell in row_data[:9]]))
         except Exception as e:
             print(f"Error fetching data for {issuer}: {e}")
+    metrics.add_rows("parsed", len(issuer_data))
     return issuer_data
 
 
-def forward_fill_missing_dates(conn):
-    # Fetch all distinct issuers
-    with conn.cursor() as cur:
-        cur.execute("SELECT DISTINCT stock_code FROM stock_prices")
-        issuers = [row[0] for row in cur.fetchall()]
-
-    # For each issuer, perform forward fill on missing dates
-    for issuer in issuers:
-        query = """
-            SELECT date, last_price, max_price, min_price, avg_price, 
-                   percent_change, quantity, turnover_best, total_turnover
-            FROM stock_prices
-            WHERE stock_code = %s
-            ORDER BY date
-        """
-
-        # Load data for the issuer into a DataFrame for easier manipulation
-        df = pd.read_sql(query, conn, params=(issuer,))
-
-        # Generate a complete date range from the first to the last date in the dataset
-        full_date_range = pd.date_range(df['date'].min(), df['date'].max())
-
-        # Reindex the DataFrame to include the full date range and forward-fill missing data
-        df.set_index('date', inplace=True)
-        df = df.reindex(full_date_range, method='ffill')
-        df.index.name = 'date'
-        df['stock_code'] = issuer  # Re-add the stock code for each forward-filled row
-
-        # Identify the new rows that are missing in the original database
-        existing_dates_query = "SELECT date FROM stock_prices WHERE stock_code = %s"
-        with conn.cursor() as cur:
-            cur.execute(existing_dates_query, (issuer,))
-            existing_dates = {row[0] for row in cur.fetchall()}
-
-        # Filter rows that were added by the forward-fill (i.e., newly created rows)
-        forward_filled_rows = df[~df.index.isin(existing_dates)]
-
-        # Prepare and insert forward-filled data into the database
-        if not forward_filled_rows.empty:
-            insert_query = """
-                INSERT INTO stock_prices (
-                    stock_code, date, last_price, max_price, min_price, avg_price,
-                    percent_change, quantity, turnover_best, total_turnover
-                ) VALUES %s
-            """
-            formatted_data = [
-                (
-                    issuer, date, row['last_price'], row['max_price'],
-                    row['min_price'], row['avg_price'], row['percent_change'],
-                    row['quantity'], row['turnover_best'], row['total_turnover']
-                )
-                for date, row in forward_filled_rows.iterrows()
-            ]
-            with conn.cursor() as cur:
-                execute_values(cur, insert_query, formatted_data)
-            conn.commit()
-
-        print(f"Forward filled {len(forward_filled_rows)} rows for issuer {issuer}")
+def forward_fill_missing_dates(conn, incremental=FILL_MODE != "full"):
+    # One set-based statement for all issuers; incremental runs start from
+    # each issuer's last filled date instead of reloading its whole history
+    filled_counts = forward_fill_table(conn, incremental=incremental)
+    for issuer, count in filled_counts.items():
+        print(f"Forward filled {count} rows for issuer {issuer}")
+    print(f"Forward filled {sum(filled_counts.values())} rows for {len(filled_counts)} issuers")
 
 
 def main():
@@ -204,12 +125,12 @@ def main():
     total_records_added = 0  # Initialize a counter for the number of records added
 
     # Use ThreadPoolExecutor to fetch data in parallel
-    with ThreadPoolExecutor(max_workers=50) as executor:
+    with ThreadPoolExecutor(max_workers=50) as executor, CopySink(conn, table="stock_prices") as sink:
         for issuer in issuers_data:
             results = executor.map(lambda dr: fetch_issuer_data(issuer, *dr), date_ranges)
             for result in results:
                 if result:
-                    insert_data_to_db(conn, result)
+                    insert_data_to_db(sink, result)
                     total_records_added += len(result)  # Increment by the number of records in the result
 
     # End timer and display time taken
@@ -219,6 +140,7 @@ def main():
 
     # Call forward fill function
     forward_fill_missing_dates(conn)
+    metrics.emit_run("data_scraper", time.time() - start_time, records=total_records_added)
 
     # Close the database connection
     conn.close()
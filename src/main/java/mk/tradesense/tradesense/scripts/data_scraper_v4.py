@@ -1,15 +1,32 @@
-import requests
 from bs4 import BeautifulSoup
+from contextlib import nullcontext
 from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import psycopg2
-from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+import threading
 import time
 import os
 from dotenv import load_dotenv
 # Load environment variables from the .env file
 load_dotenv()
 
+# Local modules read their settings from the environment at import time
+import metrics
+from bulk_loader import create_sink, prepare_ingest
+from checkpoint_journal import CheckpointJournal
+from concurrency_controller import get_controller
+from fetch_scheduler import FetchScheduler
+from http_session import FetchTimeout, get_session
+from indicators import IndicatorEngine
+from ingest_pipeline import WRITERS, IngestPipeline
+from parquet_archive import ARCHIVE_DIR, ArchiveWriter
+from parse_pool import ParsePool
+from range_planner import RangePlanner, densities_from_history
+from response_cache import cache_key, get_cache, is_closed_range
+from stock_row import row_from_cells
+from table_parser import parse_results_table
+
 # Database configuration using environment variables
 DB_CONFIG = {
     "dbname": os.getenv("DB_NAME"),
@@ -19,7 +36,7 @@ DB_CONFIG = {
     "port": os.getenv("DB_PORT")
 }
 
-base_url = "https://www.mse.mk/mk/stats/symbolhistory/"
+base_url = os.getenv("MSE_BASE_URL", "https://www.mse.mk/mk/stats/symbolhistory/")
 issuers_data = []
 
 
@@ -27,128 +44,228 @@ def num_there(s):
     return any(i.isdigit() for i in s)
 
 
+def parse_issuers(content):
+    issuers = []
+    soup = BeautifulSoup(content, "html.parser")
+    issuers_elements = soup.select("#Code option")
+    for option in issuers_elements:
+        issuer = option.text.strip()
+        if issuer and not num_there(issuer):
+            issuers.append(issuer)
+    return issuers
+
+
+def cached_download(key, closed, download):
+    cache = get_cache()
+    if cache is None:
+        return download()
+    return cache.fetch(key, closed, download)
+
+
 def get_issuers():
     issuers_url = f"{base_url}kmb"
-    with requests.Session() as session:
-        response = session.get(issuers_url)
-        soup = BeautifulSoup(response.content, "html.parser")
-        issuers_elements = soup.select("#Code option")
-        for option in issuers_elements:
-            issuer = option.text.strip()
-            if issuer and not num_there(issuer):
-                issuers_data.append(issuer)
+    with metrics.timed("get_issuers"):
+        content = cached_download(cache_key(issuers_url), False, lambda: get_session().get(issuers_url).content)
+        issuers_data.extend(parse_issuers(content))
 
 
-def get_last_scraped_date(conn):
+def get_issuer_history(conn):
+    # Per-issuer (first date, last date, row count): the last date is the
+    # watermark each issuer is scraped from, the rest gives its trading density
     with conn.cursor() as cur:
-        cur.execute("SELECT MAX(TO_DATE(date, 'DD.MM.YYYY')) FROM stock_items")
-        result = cur.fetchone()
-        return result[0] if result[0] else None
-
-
-def insert_data_to_db(conn, stock_data):
-    stock_data_sorted = sorted(stock_data, key=lambda x: (
-    x['Издавач'], datetime.strptime(x['Датум'], "%d.%m.%Y") if x['Датум'] else datetime.min))
-
-    insert_query = """
-        INSERT INTO stock_items (
-            stock_code, date, last_price, max_price, min_price, avg_price,
-            percent_change, quantity, turnover_best, total_turnover
-        ) VALUES %s
-    """
-
-    formatted_data = [
-        (
-            record['Издавач'],
-            record['Датум'],
-            record['Цена на последна трансакција'],
-            record['Макс.'],
-            record['Мин.'],
-            record['Просечна цена'],
-            record['% пром.'],
-            record['Количина'],
-            record['Промет во БЕСТ во денари'],
-            record['Вкупен промет во денари']
-        )
-        for record in stock_data_sorted
-    ]
+        cur.execute("""
+            SELECT stock_code, MIN(TO_DATE(date, 'DD.MM.YYYY')), MAX(TO_DATE(date, 'DD.MM.YYYY')), COUNT(*)
+            FROM stock_items
+            GROUP BY stock_code
+        """)
+        return {stock_code: (first_date, last_date, row_count)
+                for stock_code, first_date, last_date, row_count in cur.fetchall() if last_date}
+
+
+def format_records(stock_data):
+    # StockRow fields are already in column order; only the ordering is applied here
+    with metrics.timed("format"):
+        return sorted(stock_data, key=lambda x: (
+        x.stock_code, datetime.strptime(x.date, "%d.%m.%Y") if x.date else datetime.min))
 
-    with conn.cursor() as cur:
-        execute_values(cur, insert_query, formatted_data)
-    conn.commit()
+
+def build_payload(issuer, start_date, end_date):
+    return {
+        "FromDate": start_date.strftime("%d.%m.%Y"),
+        "ToDate": end_date.strftime("%d.%m.%Y"),
+        "Issuer": issuer
+    }
+
+
+def parse_issuer_data(issuer, html, backend=None):
+    with metrics.timed("parse"):
+        records = [row_from_cells(issuer, row_data) for row_data in parse_results_table(html, backend)]
+    metrics.add_rows("parsed", len(records))
+    return records
+
+
+def fetch_issuer_page(issuer, start_date, end_date):
+    # Raw response bytes, decoded by whoever parses them
+    url = f"{base_url}{issuer}"
+    payload = build_payload(issuer, start_date, end_date)
+    with metrics.timed("fetch"):
+        return cached_download(cache_key(url, payload["FromDate"], payload["ToDate"]), is_closed_range(end_date),
+                               lambda: get_session().post(url, data=payload).content)
+
+
+def fetch_issuer_html(issuer, start_date, end_date):
+    return fetch_issuer_page(issuer, start_date, end_date).decode("utf-8", errors="replace")
 
 
 def fetch_issuer_data(issuer, start_date, end_date):
-    if start_date!=end_date:
-        issuer_data = []
-        url = f"{base_url}{issuer}"
-        with requests.Session() as session:
-            payload = {
-                "FromDate": start_date.strftime("%d.%m.%Y"),
-                "ToDate": end_date.strftime("%d.%m.%Y"),
-                "Issuer": issuer
-            }
-            try:
-                response = session.post(url, data=payload)
-                soup = BeautifulSoup(response.text, "html.parser")
-                table_body = soup.select_one("#resultsTable tbody")
-                if not table_body:
-                    return []
-                for row in table_body.find_all("tr"):
-                    row_data = row.find_all("td")
-                    if len(row_data) < 9:
-                        continue
-                    record = {
-                        "Издавач": issuer,
-                        "Датум": row_data[0].text.strip() or None,
-                        "Цена на последна трансакција": row_data[1].text.strip() or None,
-                        "Макс.": row_data[2].text.strip() or None,
-                        "Мин.": row_data[3].text.strip() or None,
-                        "Просечна цена": row_data[4].text.strip() or None,
-                        "% пром.": row_data[5].text.strip() or None,
-                        "Количина": row_data[6].text.strip() or None,
-                        "Промет во БЕСТ во денари": row_data[7].text.strip() or None,
-                        "Вкупен промет во денари": row_data[8].text.strip() or None,
-                    }
-
-                    issuer_data.append(record)
-
-            except Exception as e:
-                print(f"Error fetching data for {issuer}: {e}")
-
-        return issuer_data
+    return parse_issuer_data(issuer, fetch_issuer_html(issuer, start_date, end_date))
 
 
-def main():
-    conn = psycopg2.connect(**DB_CONFIG)
-    get_issuers()
+def build_units(issuers, last_scraped_dates, end_date, planner):
+    default_start_date = end_date - timedelta(days=365 * 10)
+    units = []
+    for issuer in issuers:
+        last_scraped_date = last_scraped_dates.get(issuer)
+        start_date = (last_scraped_date + timedelta(days=1)) if last_scraped_date else default_start_date
+        units.extend(planner.plan(issuer, start_date, end_date))
+    return units
+
+
+def connect():
+    return psycopg2.connect(**DB_CONFIG)
+
+
+_writer_pool = None
+_writer_pool_lock = threading.Lock()
+
+
+def get_writer_pool():
+    # Kept open across runs, so the daemon's refreshes reuse warm connections
+    global _writer_pool
+    with _writer_pool_lock:
+        if _writer_pool is None or _writer_pool.closed:
+            _writer_pool = ThreadedConnectionPool(1, WRITERS, **DB_CONFIG)
+        return _writer_pool
 
-    last_scraped_date = get_last_scraped_date(conn)
-    start_date = (last_scraped_date + timedelta(days=1)) if last_scraped_date else datetime.now().date() - timedelta(
-        days=365 * 10)
-    end_date = datetime.now().date()
 
-    date_ranges = [(start_date + timedelta(days=365 * i),
-                    min(start_date + timedelta(days=365 * (i + 1)) - timedelta(days=1), end_date)) for i in
-                   range((end_date.year - start_date.year) + 1)]
+def close_writer_pool():
+    global _writer_pool
+    with _writer_pool_lock:
+        if _writer_pool is not None and not _writer_pool.closed:
+            _writer_pool.closeall()
+        _writer_pool = None
+
+
+def run_refresh(conn, issuers, parse_pool=None):
+    # One incremental scrape of `issuers` from their watermarks up to today.
+    # Units left pending by an interrupted run are scheduled first; new ones
+    # start after the last day any journaled unit covers. Returns a summary
+    # dict; used by main() and by scraper_daemon.py, which passes the
+    # ParsePool it keeps warm between refreshes (one is started otherwise).
+    history = get_issuer_history(conn)
+    last_scraped_dates = {issuer: last_date for issuer, (_, last_date, _) in history.items()}
+    journal = CheckpointJournal(conn)
+    journal.ensure_table()
+    resumed_units = journal.load()
+    for issuer, planned_through in journal.planned_through.items():
+        last_scraped_dates[issuer] = max(planned_through, last_scraped_dates.get(issuer, planned_through))
+    print(journal.report())
+    planner = RangePlanner(densities_from_history(history))
+    end_date = datetime.now().date()
+    new_units = build_units(issuers, last_scraped_dates, end_date, planner)
+    journal.record(new_units)
+    units = resumed_units + new_units
 
     start_time = time.time()
+    summary = {"started_at": start_time, "units": len(units), "records": 0, "failed": [],
+               "skipped_units": journal.done_units}
 
-    if start_date == end_date:
+    if not units:
         print(f"No new data to scrape")
     else:
-        with ThreadPoolExecutor(max_workers=50) as executor:
-            for issuer in issuers_data:
-                results = executor.map(lambda dr: fetch_issuer_data(issuer, *dr), date_ranges)
-                for result in results:
-                    if result:
-                        insert_data_to_db(conn, result)
+        print(f"Scraping {len(units)} date ranges for {len({unit[0] for unit in units})} issuers")
+        prepare_ingest(conn)
+        # Optional Parquet copy of everything fetched, written from the fetch threads
+        archive = ArchiveWriter(ARCHIVE_DIR) if ARCHIVE_DIR else None
+        # Derived series of the issuers touched, updated once the rows are in
+        indicators = IndicatorEngine()
+        # Fetch threads only download; pages are parsed in worker processes
+        sink_factory = partial(create_sink, journal=journal)
+        # A pool passed in stays open for the next refresh; one started here is closed here
+        if parse_pool is not None:
+            parse_pool.reset()
+        parse_pool_context = ParsePool() if parse_pool is None else nullcontext(parse_pool)
+        with parse_pool_context as parse_pool, IngestPipeline(get_writer_pool(), sink_factory) as pipeline:
+            def requeue_split(unit):
+                smaller_units = planner.split(unit)
+                if smaller_units:
+                    journal.split(unit, smaller_units)
+                    scheduler.requeue(smaller_units)
+                return bool(smaller_units)
+
+            def fetch_and_queue(issuer, start_date, end_date):
+                # Timed-out windows are fetched again as smaller ones; any other
+                # failure leaves the unit pending in the journal
+                unit = (issuer, start_date, end_date)
+                try:
+                    records = format_records(parse_pool.parse(issuer, fetch_issuer_page(issuer, start_date, end_date)))
+                except FetchTimeout:
+                    if not requeue_split(unit):
+                        raise
+                    return 0
+                planner.observe(unit, len(records))
+                # Queued even when empty, so the unit is marked done with the rows
+                pipeline.put(records, unit)
+                if records:
+                    indicators.add(records)
+                    if archive is not None:
+                        archive.add(records)
+                return len(records)
+
+            # Threads only bound the controller's limit; it decides how many requests are in flight
+            scheduler = FetchScheduler(fetch_and_queue, max_workers=get_controller().max_limit)
+            total_records = 0
+            for unit, record_count in scheduler.run(units):
+                total_records += record_count
+        indicators.update(conn)
+        print(scheduler.report())
+        print(planner.report())
+        print(parse_pool.report())
+        print(pipeline.report())
+        print(get_session().report())
+        print(get_controller().report())
+        if get_cache() is not None:
+            print(get_cache().report())
+        if archive is not None:
+            print(archive.report())
+        print(indicators.report())
+        print(f"Total records fetched: {total_records}")
+        for issuer, range_start, range_end in scheduler.failed:
+            print(f"Failed to fetch {issuer} from {range_start} to {range_end}")
+        pending_units = journal.clear_if_finished()
+        if pending_units:
+            print(f"{pending_units} units stay pending in the checkpoint journal for the next run")
+        summary["records"] = total_records
+        summary["requests_saved"] = planner.requests_saved()
+        summary["failed"] = [(issuer, str(range_start), str(range_end))
+                             for issuer, range_start, range_end in scheduler.failed]
 
     elapsed_time = time.time() - start_time
     print(f"Data scraping and insertion took {elapsed_time:.2f} seconds.")
+    summary["elapsed"] = elapsed_time
+    metrics.set_gauge("scraper_concurrency_limit", get_controller().limit)
+    print(f"Metrics written to {metrics.emit_run('data_scraper_v4', elapsed_time, units=len(units), records=summary['records'])}")
+    return summary
+
 
+def main():
+    conn = connect()
+    get_issuers()
+    summary = run_refresh(conn, issuers_data)
     conn.close()
+    close_writer_pool()
+    return summary
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,68 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class FetchScheduler:
+    # Runs every (issuer, start_date, end_date) unit through one shared pool.
+    # At most `queue_size` units are submitted at a time so a long backfill
+    # never materializes thousands of futures, and results are yielded in
+    # completion order instead of issuer by issuer. Units passed to requeue()
+    # (from any thread, e.g. a fetch splitting its own window) run before the
+    # remaining input.
+    def __init__(self, fetch, max_workers=50, queue_size=None):
+        self.fetch = fetch
+        self.max_workers = max_workers
+        self.queue_size = queue_size or max_workers * 2
+        self.completed = 0
+        self.failed = []
+        self.requeued = deque()
+        self.started_at = None
+        self.finished_at = None
+
+    def run(self, units):
+        self.started_at = time.time()
+        units = iter(units)
+        pending = {}
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while True:
+                while len(pending) < self.queue_size:
+                    unit = self.requeued.popleft() if self.requeued else next(units, None)
+                    if unit is None:
+                        break
+                    pending[executor.submit(self.fetch, *unit)] = unit
+
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    unit = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"Error fetching data for {unit[0]} from {unit[1]} to {unit[2]}: {e}")
+                        self.failed.append(unit)
+                        continue
+                    self.completed += 1
+                    yield unit, result
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.finished_at = time.time()
+
+    def requeue(self, units):
+        self.requeued.extend(units)
+
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def throughput(self):
+        elapsed = self.elapsed()
+        return self.completed / elapsed if elapsed else 0.0
+
+    def report(self):
+        return (f"Fetched {self.completed} units ({len(self.failed)} failed) in {self.elapsed():.2f} seconds "
+                f"({self.throughput():.2f} units/s)")
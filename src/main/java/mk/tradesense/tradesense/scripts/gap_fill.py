@@ -0,0 +1,150 @@
+from itertools import repeat
+
+import numpy as np
+
+import metrics
+from normalizer import format_mk_dates, parse_mk_dates
+from stock_row import StockRow
+
+# Forward fill of non-trading days, computed per issuer on a date array:
+# the full calendar range is built with one np.arange, each day is mapped to
+# the last trading row on or before it with one searchsorted, and the missing
+# days copy that row's prices with zero change, volume and turnover. Same
+# output as the old day-by-day loop, in time linear in the filled range.
+
+ZERO = "0"
+
+
+def fill_issuer_gaps(records):
+    # records: StockRows of one issuer, every one with a date. Returns the
+    # filled rows followed by the records in date order, like the old loop.
+    if len(records) < 2:
+        return list(records)
+    dates = parse_mk_dates([record.date for record in records])
+    order = np.argsort(dates, kind="stable")
+    sorted_dates = dates[order]
+    full_range = np.arange(sorted_dates[0], sorted_dates[-1] + np.timedelta64(1, "D"))
+
+    last_trade = np.searchsorted(sorted_dates, full_range, side="right") - 1
+    missing = sorted_dates[last_trade] != full_range
+    sorted_records = [records[i] for i in order.tolist()]
+    if not missing.any():
+        return sorted_records
+    source = order[last_trade[missing]]
+
+    columns = list(zip(*records))
+    prices = [np.asarray(columns[i], dtype=object)[source].tolist() for i in range(2, 6)]
+    filled = list(map(StockRow._make, zip(
+        repeat(records[0].stock_code),
+        format_mk_dates(full_range[missing]).tolist(),
+        *prices,
+        repeat(ZERO), repeat(ZERO), repeat(ZERO), repeat(ZERO),
+    )))
+    filled.extend(sorted_records)
+    return filled
+
+
+def forward_fill_data(stock_data):
+    with metrics.timed("forward_fill"):
+        filled_data = _forward_fill_data(stock_data)
+    metrics.add_rows("forward_filled", len(filled_data) - len(stock_data))
+    return filled_data
+
+
+def _forward_fill_data(stock_data):
+    grouped_by_issuer = {}
+    undated = []
+    for record in stock_data:
+        if record.date:
+            grouped_by_issuer.setdefault(record.stock_code, []).append(record)
+        else:
+            undated.append(record)
+
+    filled_data = undated
+    for issuer in sorted(grouped_by_issuer):
+        filled_data.extend(fill_issuer_gaps(grouped_by_issuer[issuer]))
+    return filled_data
+
+
+# The same fill done inside Postgres for the typed stock_prices table. Each
+# issuer's days from its fill watermark to its latest row are generated with
+# generate_series, missing ones take every column of the last row on or
+# before them through a LATERAL index probe, and the watermark moves to the
+# latest row in the same statement. Issuers are found with a loose index
+# scan, so an incremental run touches only days added since the last fill.
+# incremental=False starts every issuer from its first row instead.
+
+FILL_TABLE = "stock_prices"
+FILL_COLUMNS = ("last_price", "max_price", "min_price", "avg_price",
+                "percent_change", "quantity", "turnover_best", "total_turnover")
+
+
+def ensure_fill_tables(conn, table=FILL_TABLE):
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {table}_stock_code_date_idx ON {table} (stock_code, date)")
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table}_fill_watermarks (
+                stock_code VARCHAR(255) PRIMARY KEY,
+                filled_through DATE NOT NULL
+            )
+        """)
+    conn.commit()
+
+
+def forward_fill_table(conn, incremental=True, table=FILL_TABLE, columns=FILL_COLUMNS):
+    ensure_fill_tables(conn, table)
+    watermarks = f"{table}_fill_watermarks"
+    column_list = ", ".join(columns)
+    query = f"""
+        WITH RECURSIVE issuers AS (
+            (SELECT stock_code FROM {table} ORDER BY stock_code LIMIT 1)
+            UNION ALL
+            SELECT (SELECT t.stock_code FROM {table} t WHERE t.stock_code > issuers.stock_code
+                    ORDER BY t.stock_code LIMIT 1)
+            FROM issuers WHERE issuers.stock_code IS NOT NULL
+        ),
+        bounds AS (
+            SELECT i.stock_code,
+                   COALESCE(CASE WHEN %(incremental)s THEN w.filled_through END,
+                            (SELECT MIN(t.date) FROM {table} t WHERE t.stock_code = i.stock_code)) AS from_date,
+                   (SELECT MAX(t.date) FROM {table} t WHERE t.stock_code = i.stock_code) AS to_date
+            FROM issuers i
+            LEFT JOIN {watermarks} w ON w.stock_code = i.stock_code
+            WHERE i.stock_code IS NOT NULL
+        ),
+        days AS (
+            SELECT b.stock_code, d::date AS date
+            FROM bounds b, generate_series(b.from_date, b.to_date, interval '1 day') d
+            WHERE b.to_date > b.from_date
+        ),
+        filled AS (
+            INSERT INTO {table} (stock_code, date, {column_list})
+            SELECT days.stock_code, days.date, {', '.join(f'prev.{column}' for column in columns)}
+            FROM days
+            CROSS JOIN LATERAL (
+                SELECT {column_list} FROM {table} t
+                WHERE t.stock_code = days.stock_code AND t.date < days.date
+                ORDER BY t.date DESC LIMIT 1
+            ) prev
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {table} t WHERE t.stock_code = days.stock_code AND t.date = days.date
+            )
+            RETURNING stock_code
+        ),
+        marked AS (
+            INSERT INTO {watermarks} (stock_code, filled_through)
+            SELECT stock_code, to_date FROM bounds WHERE to_date IS NOT NULL
+            ON CONFLICT (stock_code) DO UPDATE SET filled_through = EXCLUDED.filled_through
+        )
+        SELECT stock_code, COUNT(*) FROM filled GROUP BY stock_code ORDER BY stock_code
+    """
+    try:
+        with metrics.timed("forward_fill_db"), conn.cursor() as cur:
+            cur.execute(query, {"incremental": incremental})
+            filled_counts = dict(cur.fetchall())
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    metrics.add_rows("forward_filled", sum(filled_counts.values()))
+    return filled_counts
@@ -0,0 +1,107 @@
+import numpy as np
+
+import metrics
+from normalizer import EMPTY_DEFAULTS, NUMERIC_FIELDS
+
+# Streams stock history out of Postgres as typed NumPy column chunks through
+# a named (server-side) cursor. Postgres packs each chunk of up to chunk_rows
+# rows into one binary string per column (int4send/float8send aggregated in
+# date order), so the client turns every column into an array with
+# np.frombuffer and never builds a Python object per row or value. Memory is
+# bounded by chunk_rows x itersize rows. stock_prices is read as typed;
+# stock_items' scraped text is converted on the server the way normalizer
+# converts it on the client. Rows without a date are skipped.
+
+CHUNK_ROWS = 50000
+# Chunks fetched per round trip
+ITERSIZE = 4
+EPOCH = np.datetime64("1970-01-01", "D")
+
+
+def _expressions(table):
+    # (date expression, {field: float8 expression}) for the table's storage
+    if table == "stock_items":
+        date = "to_date(NULLIF(date, ''), 'DD.MM.YYYY')"
+        numbers = {field: f"NULLIF(replace(replace({field}, '.', ''), ',', '.'), '')::float8"
+                   for field in NUMERIC_FIELDS}
+    else:
+        date = "date::date"
+        numbers = {field: f"{field}::float8" for field in NUMERIC_FIELDS}
+    return date, {field: f"COALESCE({expression}, '{EMPTY_DEFAULTS.get(field, 'NaN')}'::float8)"
+                  for field, expression in numbers.items()}
+
+
+def history_query(table, fields, by_issuer, filtered, dated_after=False):
+    date, numbers = _expressions(table)
+    conditions = [f"{date} IS NOT NULL"]
+    if filtered:
+        conditions.append("stock_code = ANY(%(issuers)s)")
+    if dated_after:
+        conditions.append(f"{date} > %(after)s")
+    where = "\n              AND ".join(conditions)
+    # by_issuer numbers rows within each issuer, so no chunk spans two
+    window = f"PARTITION BY stock_code ORDER BY {date}" if by_issuer else f"ORDER BY stock_code, {date}"
+    order = "stock_code, chunk" if by_issuer else "chunk, stock_code"
+    # seq is unique, so every column is packed in the same row order
+    packed = "".join(f",\n               string_agg(float8send({field}), ''::bytea ORDER BY seq)" for field in fields)
+    return f"""
+        SELECT (seq - 1) / %(chunk_rows)s AS chunk, stock_code, COUNT(*),
+               string_agg(int4send(day - DATE '1970-01-01'), ''::bytea ORDER BY seq){packed}
+        FROM (
+            SELECT stock_code, {date} AS day,
+                   {', '.join(f'{numbers[field]} AS {field}' for field in fields)},
+                   row_number() OVER ({window}) AS seq
+            FROM {table}
+            WHERE {where}
+        ) numbered
+        GROUP BY chunk, stock_code
+        ORDER BY {order}
+    """
+
+
+def _decode(stock_code, row_count, packed_dates, packed_fields, fields):
+    batch = {
+        "stock_code": np.full(row_count, stock_code, dtype=object),
+        "date": EPOCH + np.frombuffer(packed_dates, dtype=">i4").astype("timedelta64[D]"),
+    }
+    for field, packed in zip(fields, packed_fields):
+        batch[field] = np.frombuffer(packed, dtype=">f8").astype(np.float64)
+    return batch
+
+
+def _concat(batches):
+    if len(batches) == 1:
+        return batches[0]
+    return {column: np.concatenate([batch[column] for batch in batches]) for column in batches[0]}
+
+
+def iter_history(conn, table="stock_prices", issuers=None, fields=NUMERIC_FIELDS, chunk_rows=CHUNK_ROWS,
+                 itersize=ITERSIZE, by_issuer=False, after=None):
+    # Yields {"stock_code", "date", <field>...} batches like
+    # normalizer.normalize_batch, in (stock_code, date) order. With by_issuer
+    # every batch holds one issuer; otherwise a batch holds up to chunk_rows
+    # rows across as many issuers as they cover. With `after`, only rows
+    # dated after that day.
+    if isinstance(issuers, str):
+        issuers = [issuers]
+    fields = tuple(fields)
+    query = history_query(table, fields, by_issuer, issuers is not None, after is not None)
+    pending = []
+    pending_chunk = None
+    with conn.cursor(name=f"{table}_history_reader") as cur:
+        cur.itersize = itersize
+        cur.execute(query, {"chunk_rows": chunk_rows, "issuers": list(issuers or ()), "after": after})
+        for chunk, stock_code, row_count, packed_dates, *packed_fields in cur:
+            batch = _decode(stock_code, row_count, packed_dates, packed_fields, fields)
+            metrics.add_rows("read", row_count)
+            if by_issuer:
+                yield batch
+                continue
+            # The pieces of one global chunk arrive together, one per issuer
+            if chunk != pending_chunk and pending:
+                yield _concat(pending)
+                pending = []
+            pending_chunk = chunk
+            pending.append(batch)
+    if pending:
+        yield _concat(pending)
@@ -0,0 +1,140 @@
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from concurrency_controller import ERROR, get_controller, outcome_for_status
+
+# One pooled keep-alive session shared by every fetch, so the thousands of
+# (issuer, range) requests of a backfill reuse a handful of TCP/TLS
+# connections. 5xx, 429, timeouts, connection errors and bodies cut off
+# mid-transfer are retried with jittered exponential backoff; anything still
+# failing raises FetchError instead of being swallowed. Every attempt holds a
+# slot of the adaptive concurrency controller, which sizes the number of
+# requests in flight.
+
+POOL_SIZE = int(os.getenv("SCRAPER_POOL_SIZE", "50"))
+MAX_RETRIES = int(os.getenv("SCRAPER_MAX_RETRIES", "4"))
+CONNECT_TIMEOUT = float(os.getenv("SCRAPER_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.getenv("SCRAPER_READ_TIMEOUT", "60"))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+
+class FetchError(Exception):
+    pass
+
+
+class FetchTimeout(FetchError):
+    # The last attempt connected but the response did not arrive in time,
+    # which a smaller date window can fix; refusals, 5xx and 429 cannot
+    pass
+
+
+def is_retryable_status(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+class ScraperSession:
+    def __init__(self, pool_size=POOL_SIZE, max_retries=MAX_RETRIES,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX,
+                 controller=None):
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.controller = controller
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.lock = threading.Lock()
+        self.retries = 0
+        self.failures = 0
+
+    def backoff(self, attempt):
+        # Full jitter keeps 50 workers that failed together from retrying together.
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.max_retries + 1):
+            started = self.controller.acquire() if self.controller is not None else None
+            outcome = ERROR
+            request_started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+                outcome = outcome_for_status(response.status_code)
+                metrics.inc("scraper_http_bytes_total", len(response.content))
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.ContentDecodingError) as e:
+                error = e
+            else:
+                if not is_retryable_status(response.status_code):
+                    response.raise_for_status()
+                    return response
+                error = requests.HTTPError(f"{response.status_code} {response.reason}", response=response)
+            finally:
+                if started is not None:
+                    self.controller.release(started, outcome)
+                metrics.observe("scraper_http_request_seconds", time.perf_counter() - request_started, method=method)
+                metrics.inc("scraper_http_requests_total", method=method, outcome=outcome)
+
+            if attempt == self.max_retries:
+                with self.lock:
+                    self.failures += 1
+                failure = FetchTimeout if isinstance(error, requests.exceptions.ReadTimeout) else FetchError
+                raise failure(f"{method} {url} failed after {attempt + 1} attempts: {error}") from error
+
+            with self.lock:
+                self.retries += 1
+            metrics.inc("scraper_http_retries_total")
+            time.sleep(self.backoff(attempt))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def connection_stats(self):
+        connections = 0
+        requests_sent = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                requests_sent += pool.num_requests
+        return {
+            "requests": requests_sent,
+            "connections": connections,
+            "reused": requests_sent - connections,
+            "retries": self.retries,
+            "failures": self.failures,
+        }
+
+    def report(self):
+        stats = self.connection_stats()
+        reuse = stats["reused"] / stats["requests"] * 100 if stats["requests"] else 0.0
+        return (f"HTTP: {stats['requests']} requests over {stats['connections']} connections "
+                f"({reuse:.1f}% reused), {stats['retries']} retries, {stats['failures']} failures")
+
+    def close(self):
+        self.session.close()
+
+
+_shared_session = None
+_shared_session_lock = threading.Lock()
+
+
+def get_session():
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            _shared_session = ScraperSession(controller=get_controller())
+        return _shared_session
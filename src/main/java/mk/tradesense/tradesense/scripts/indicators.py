@@ -0,0 +1,331 @@
+import argparse
+import math
+import statistics
+import threading
+from collections import deque
+from datetime import timedelta
+from itertools import islice
+
+import numpy as np
+from psycopg2.extras import Json, execute_values
+
+import metrics
+from history_reader import iter_history
+from normalizer import normalize_batch
+from stock_row import STOCK_COLUMNS
+
+# Derived per-issuer series kept up to date at ingest time, so whoever reads
+# stock_items no longer recomputes them from full history:
+#   stock_indicators       per day: SMA and EMA at several windows, the
+#                          annualized volatility of log returns and RSI
+#   stock_rollups          weekly and monthly OHLC, volume and turnover
+#   stock_indicator_state  the rolling state after each issuer's last day
+# Each run continues from the stored state with every stock_items row after
+# the issuer's last processed day, not only the rows it just ingested, so
+# days stored by a run that never got to its indicator update (a crash, a
+# failed writer) are picked up by the next one, and a daily update costs
+# O(new rows). An issuer without state, or whose new rows reach back to or
+# before its last processed day (a backfilled gap), is rebuilt from its full
+# stock_items history instead.
+
+SMA_WINDOWS = (5, 20, 50, 200)
+EMA_SPANS = (12, 26)
+VOLATILITY_WINDOW = 20
+RSI_PERIOD = 14
+TRADING_DAYS = 252
+
+INDICATOR_COLUMNS = (
+    tuple(f"sma_{window}" for window in SMA_WINDOWS)
+    + tuple(f"ema_{span}" for span in EMA_SPANS)
+    + (f"volatility_{VOLATILITY_WINDOW}", f"rsi_{RSI_PERIOD}")
+)
+ROLLUP_PERIODS = {
+    "week": lambda day: day - timedelta(days=day.weekday()),
+    "month": lambda day: day.replace(day=1),
+}
+SERIES_FIELDS = ("close", "high", "low", "volume", "turnover")
+
+
+class IndicatorState:
+    def __init__(self, state=None):
+        state = state or {}
+        self.closes = deque(state.get("closes", ()), maxlen=max(max(SMA_WINDOWS), VOLATILITY_WINDOW + 1))
+        self.ema = {int(span): value for span, value in state.get("ema", {}).items()}
+        self.rsi_changes = state.get("rsi_changes", 0)
+        self.avg_gain = state.get("avg_gain", 0.0)
+        self.avg_loss = state.get("avg_loss", 0.0)
+
+    def push(self, close):
+        # The day's values in INDICATOR_COLUMNS order, None until there is
+        # enough history for them
+        previous = self.closes[-1] if self.closes else None
+        self.closes.append(close)
+        values = [sum(islice(reversed(self.closes), window)) / window if len(self.closes) >= window else None
+                  for window in SMA_WINDOWS]
+        for span in EMA_SPANS:
+            ema = self.ema.get(span)
+            self.ema[span] = close if ema is None else ema + 2 / (span + 1) * (close - ema)
+            values.append(self.ema[span])
+        values.append(self.volatility())
+        values.append(self.rsi(previous, close))
+        return values
+
+    def volatility(self):
+        if len(self.closes) <= VOLATILITY_WINDOW:
+            return None
+        closes = list(islice(reversed(self.closes), VOLATILITY_WINDOW + 1))
+        returns = [math.log(today / before) for today, before in zip(closes, closes[1:]) if today > 0 and before > 0]
+        if len(returns) < 2:
+            return None
+        return statistics.stdev(returns) * math.sqrt(TRADING_DAYS)
+
+    def rsi(self, previous, close):
+        # Wilder's smoothing, seeded with the plain average of the first RSI_PERIOD changes
+        if previous is None:
+            return None
+        gain = max(close - previous, 0.0)
+        loss = max(previous - close, 0.0)
+        self.rsi_changes += 1
+        if self.rsi_changes <= RSI_PERIOD:
+            self.avg_gain += gain / RSI_PERIOD
+            self.avg_loss += loss / RSI_PERIOD
+            if self.rsi_changes < RSI_PERIOD:
+                return None
+        else:
+            self.avg_gain = (self.avg_gain * (RSI_PERIOD - 1) + gain) / RSI_PERIOD
+            self.avg_loss = (self.avg_loss * (RSI_PERIOD - 1) + loss) / RSI_PERIOD
+        if self.avg_loss == 0:
+            return 100.0
+        return 100 - 100 / (1 + self.avg_gain / self.avg_loss)
+
+    def to_json(self):
+        return {
+            "closes": list(self.closes),
+            "ema": {str(span): value for span, value in self.ema.items()},
+            "rsi_changes": self.rsi_changes,
+            "avg_gain": self.avg_gain,
+            "avg_loss": self.avg_loss,
+        }
+
+
+def series_from_batch(batch):
+    # Typed batch -> {stock_code: (days, {field: array})}; the close is the
+    # last price (the average when there was none), high/low fall back to it
+    close = np.where(np.isnan(batch["last_price"]), batch["avg_price"], batch["last_price"])
+    columns = {
+        "close": close,
+        "high": np.where(np.isnan(batch["max_price"]), close, batch["max_price"]),
+        "low": np.where(np.isnan(batch["min_price"]), close, batch["min_price"]),
+        "volume": np.nan_to_num(batch["quantity"]),
+        "turnover": np.nan_to_num(batch["total_turnover"]),
+    }
+    keep = ~np.isnat(batch["date"]) & ~np.isnan(close)
+    series = {}
+    for stock_code in set(batch["stock_code"][keep]):
+        rows = np.flatnonzero(keep & (batch["stock_code"] == stock_code))
+        series[stock_code] = (batch["date"][rows], {field: columns[field][rows] for field in SERIES_FIELDS})
+    return series
+
+
+def to_series(records):
+    if not records:
+        return {}
+    return series_from_batch(normalize_batch(dict(zip(STOCK_COLUMNS, zip(*records)))))
+
+
+def merge_series(parts):
+    # Concatenated and sorted by day; the last occurrence of a day wins
+    days = np.concatenate([part_days for part_days, _ in parts])
+    columns = {field: np.concatenate([part_columns[field] for _, part_columns in parts]) for field in SERIES_FIELDS}
+    _, last = np.unique(days[::-1], return_index=True)
+    rows = len(days) - 1 - last
+    return days[rows].tolist(), {field: values[rows].tolist() for field, values in columns.items()}
+
+
+def rollup_rows(stock_code, days, columns):
+    # One (stock_code, period, start, open, high, low, close, volume, turnover)
+    # per period touched by `days`, which are in order
+    rollups = {}
+    for i, day in enumerate(days):
+        close = columns["close"][i]
+        for period, period_start in ROLLUP_PERIODS.items():
+            key = (period, period_start(day))
+            rollup = rollups.get(key)
+            if rollup is None:
+                rollups[key] = [close, columns["high"][i], columns["low"][i], close,
+                                columns["volume"][i], columns["turnover"][i]]
+            else:
+                rollup[1] = max(rollup[1], columns["high"][i])
+                rollup[2] = min(rollup[2], columns["low"][i])
+                rollup[3] = close
+                rollup[4] += columns["volume"][i]
+                rollup[5] += columns["turnover"][i]
+    return [(stock_code, period, start, *values) for (period, start), values in rollups.items()]
+
+
+def ensure_indicator_tables(conn):
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS stock_indicators (
+                stock_code VARCHAR(255) NOT NULL,
+                date DATE NOT NULL,
+                {', '.join(f'{column} DOUBLE PRECISION' for column in INDICATOR_COLUMNS)},
+                PRIMARY KEY (stock_code, date)
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS stock_rollups (
+                stock_code VARCHAR(255) NOT NULL,
+                period VARCHAR(5) NOT NULL,
+                period_start DATE NOT NULL,
+                open DOUBLE PRECISION,
+                high DOUBLE PRECISION,
+                low DOUBLE PRECISION,
+                close DOUBLE PRECISION,
+                volume DOUBLE PRECISION,
+                turnover DOUBLE PRECISION,
+                PRIMARY KEY (stock_code, period, period_start)
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS stock_indicator_state (
+                stock_code VARCHAR(255) PRIMARY KEY,
+                last_date DATE NOT NULL,
+                state JSONB NOT NULL
+            )
+        """)
+    conn.commit()
+
+
+def load_states(conn, stock_codes):
+    with conn.cursor() as cur:
+        cur.execute("SELECT stock_code, last_date, state FROM stock_indicator_state WHERE stock_code = ANY(%s)",
+                    (list(stock_codes),))
+        return {stock_code: (last_date, state) for stock_code, last_date, state in cur.fetchall()}
+
+
+def read_history(conn, stock_code, after=None):
+    # stock_code's stored series parts (only days after `after` if given),
+    # streamed as typed chunks
+    return [part for batch in iter_history(conn, "stock_items", issuers=[stock_code], by_issuer=True, after=after)
+            for part in series_from_batch(batch).values()]
+
+
+def write_series(cur, stock_code, days, columns, state):
+    # Extends stock_code's series with `days`, all after its last stored day
+    indicator_rows = [(stock_code, day, *state.push(close)) for day, close in zip(days, columns["close"])]
+    execute_values(cur, f"""
+        INSERT INTO stock_indicators (stock_code, date, {', '.join(INDICATOR_COLUMNS)}) VALUES %s
+        ON CONFLICT (stock_code, date) DO UPDATE SET
+            {', '.join(f'{column} = EXCLUDED.{column}' for column in INDICATOR_COLUMNS)}
+    """, indicator_rows)
+    # The first new period may continue one already stored
+    execute_values(cur, """
+        INSERT INTO stock_rollups (stock_code, period, period_start, open, high, low, close, volume, turnover)
+        VALUES %s
+        ON CONFLICT (stock_code, period, period_start) DO UPDATE SET
+            high = GREATEST(stock_rollups.high, EXCLUDED.high),
+            low = LEAST(stock_rollups.low, EXCLUDED.low),
+            close = EXCLUDED.close,
+            volume = stock_rollups.volume + EXCLUDED.volume,
+            turnover = stock_rollups.turnover + EXCLUDED.turnover
+    """, rollup_rows(stock_code, days, columns))
+    cur.execute("""
+        INSERT INTO stock_indicator_state (stock_code, last_date, state) VALUES (%s, %s, %s)
+        ON CONFLICT (stock_code) DO UPDATE SET last_date = EXCLUDED.last_date, state = EXCLUDED.state
+    """, (stock_code, days[-1], Json(state.to_json())))
+    return len(indicator_rows)
+
+
+def rebuild_issuer(conn, stock_code):
+    history = read_history(conn, stock_code)
+    try:
+        with conn.cursor() as cur:
+            for table in ("stock_indicators", "stock_rollups", "stock_indicator_state"):
+                cur.execute(f"DELETE FROM {table} WHERE stock_code = %s", (stock_code,))
+            row_count = write_series(cur, stock_code, *merge_series(history), IndicatorState()) if history else 0
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return row_count
+
+
+class IndicatorEngine:
+    # Collects the rows of one ingest run (add() is called from the fetch
+    # threads), then brings every touched issuer's series up to date
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.parts = {}
+        self.updated = 0
+        self.rebuilt = 0
+        self.rows = 0
+
+    def add(self, records):
+        series = to_series(records)
+        with self.lock:
+            for stock_code, part in series.items():
+                self.parts.setdefault(stock_code, []).append(part)
+
+    def update(self, conn):
+        with self.lock:
+            parts, self.parts = self.parts, {}
+        if not parts:
+            return
+        row_count = 0
+        with metrics.timed("indicators"):
+            ensure_indicator_tables(conn)
+            states = load_states(conn, parts)
+            for stock_code, issuer_parts in sorted(parts.items()):
+                first_day = min(part_days.min() for part_days, _ in issuer_parts).item()
+                last_date, state = states.get(stock_code, (None, None))
+                if last_date is None or first_day <= last_date:
+                    row_count += rebuild_issuer(conn, stock_code)
+                    self.rebuilt += 1
+                    continue
+                # What is stored, which also covers days an earlier run left without indicators
+                history = read_history(conn, stock_code, after=last_date)
+                if not history:
+                    continue
+                days, columns = merge_series(history)
+                try:
+                    with conn.cursor() as cur:
+                        row_count += write_series(cur, stock_code, days, columns, IndicatorState(state))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                self.updated += 1
+        self.rows += row_count
+        metrics.add_rows("indicators", row_count)
+
+    def report(self):
+        return (f"Indicators: {self.updated} issuers extended, {self.rebuilt} rebuilt from history, "
+                f"{self.rows} indicator rows written")
+
+
+def main():
+    import psycopg2
+
+    from data_scraper_v4 import DB_CONFIG
+
+    parser = argparse.ArgumentParser(description="Rebuild stock_indicators and stock_rollups from stock_items")
+    parser.add_argument("issuers", nargs="*", help="issuers to rebuild, all in stock_items if omitted")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        ensure_indicator_tables(conn)
+        issuers = args.issuers
+        if not issuers:
+            with conn.cursor() as cur:
+                cur.execute("SELECT DISTINCT stock_code FROM stock_items ORDER BY stock_code")
+                issuers = [stock_code for stock_code, in cur.fetchall()]
+        for stock_code in issuers:
+            print(f"{stock_code}: {rebuild_issuer(conn, stock_code)} indicator rows")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import os
+import queue
+import threading
+import zlib
+
+import metrics
+from bulk_loader import create_sink
+
+# Decouples fetching from writing: fetch workers put formatted row batches
+# on bounded queues and dedicated writer threads, each with a connection
+# from a psycopg2 pool and its own sink, drain them into large COPY batches.
+# Every writer has its own queue and batches are routed by a hash of their
+# stock_code, so one issuer's writes stay in order on one connection while
+# different issuers commit in parallel. A full queue blocks the fetch
+# workers, which caps how much is held in memory.
+
+QUEUE_SIZE = int(os.getenv("SCRAPER_QUEUE_SIZE", "200"))
+WRITERS = int(os.getenv("SCRAPER_WRITERS", "1"))
+
+_DONE = object()
+
+
+def writer_for(stock_code, writers):
+    # crc32 rather than hash(), which changes between processes
+    return zlib.crc32(stock_code.encode("utf-8")) % writers
+
+
+class IngestPipeline:
+    def __init__(self, pool, sink_factory=create_sink, writers=WRITERS, queue_size=QUEUE_SIZE):
+        # pool: getconn()/putconn() like psycopg2.pool.ThreadedConnectionPool,
+        # holding at least `writers` connections
+        self.pool = pool
+        self.sink_factory = sink_factory
+        self.writers = max(1, writers)
+        self.queues = [queue.Queue(maxsize=max(1, queue_size // self.writers)) for _ in range(self.writers)]
+        self.threads = []
+        self.sinks = []
+        self.errors = []
+        self.peak_depth = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        for i, writer_queue in enumerate(self.queues):
+            thread = threading.Thread(target=self._write, args=(writer_queue,), name=f"db-writer-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def _write(self, writer_queue):
+        conn = None
+        finished = False
+        try:
+            conn = self.pool.getconn()
+            sink = self.sink_factory(conn)
+            with self.lock:
+                self.sinks.append(sink)
+            with sink:
+                while True:
+                    item = writer_queue.get()
+                    if item is _DONE:
+                        finished = True
+                        break
+                    sink.add(*item)
+        except Exception as e:
+            print(f"Writer {threading.current_thread().name} failed: {e}")
+            with self.lock:
+                self.errors.append(e)
+            # Keep draining so producers blocked on put() can finish.
+            while not finished:
+                finished = writer_queue.get() is _DONE
+        finally:
+            if conn is not None:
+                self.pool.putconn(conn, close=bool(conn.closed))
+
+    def put(self, rows, unit=None):
+        # unit: the (issuer, start_date, end_date) `rows` complete, for the journal
+        stock_code = unit[0] if unit is not None else rows[0][0]
+        self.queues[writer_for(stock_code, self.writers)].put((rows, unit))
+        depth = sum(writer_queue.qsize() for writer_queue in self.queues)
+        if depth > self.peak_depth:
+            self.peak_depth = depth
+        metrics.set_gauge("scraper_queue_depth", depth)
+        metrics.max_gauge("scraper_queue_depth_peak", depth)
+
+    def close(self):
+        for writer_queue in self.queues:
+            writer_queue.put(_DONE)
+        for thread in self.threads:
+            thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+    def rows_written(self):
+        return sum(sink.rows_written for sink in self.sinks)
+
+    def report(self):
+        lines = [sink.report() for sink in self.sinks]
+        capacity = sum(writer_queue.maxsize for writer_queue in self.queues)
+        lines.append(f"Writer queues peaked at {self.peak_depth}/{capacity} batches over {self.writers} writers")
+        return "\n".join(lines)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,203 @@
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import sys
+import tempfile
+import time
+
+import stand_in_server
+
+# End-to-end load test: data_scraper_v4.main() against stand_in_server with
+# N issuers x M years of history and injected faults (latency distribution,
+# 500s, slow or truncated bodies, a 429 rate limit). The stand-in and the
+# scraper each run in their own process, so the peak RSS reported is the
+# scraper's alone. Reports rows/s, p50/p99 HTTP latency, request outcomes,
+# the final concurrency limit and the ranges that still failed.
+#
+# With --db null (the default) every statement goes to a connection that
+# accepts and discards it, which leaves fetching, parsing and the writer
+# queue under test; --db env writes to the Postgres configured in .env.
+
+SERVER_STARTUP = 0.5
+
+
+class NullCursor:
+    rowcount = 0
+
+    def __init__(self, connection):
+        # execute_values reads the connection's encoding and calls mogrify
+        self.connection = connection
+        self.rows = 0
+        self.query = ""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def execute(self, query, params=None):
+        self.query = query
+
+    def mogrify(self, query, params=None):
+        return b""
+
+    def copy_expert(self, query, file):
+        self.rows = sum(1 for _ in file)
+
+    def fetchone(self):
+        # The unique index is present; otherwise the merge counts
+        if "pg_index" in self.query:
+            return (True,)
+        return self.rows, self.rows, 0
+
+    def fetchall(self):
+        return []
+
+    def __iter__(self):
+        return iter(())
+
+
+class NullConnection:
+    closed = 0
+    encoding = "UTF8"
+
+    def cursor(self, name=None):
+        return NullCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class NullPool:
+    closed = False
+
+    def getconn(self):
+        return NullConnection()
+
+    def putconn(self, conn, close=False):
+        pass
+
+    def closeall(self):
+        pass
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def run_scraper(base_url, db, metrics_dir, results):
+    # Runs in the child process; the settings have to be in place before
+    # data_scraper_v4 and its modules read them at import time
+    os.environ["MSE_BASE_URL"] = base_url
+    os.environ["SCRAPER_CACHE_MODE"] = "off"
+    os.environ["SCRAPER_METRICS_DIR"] = metrics_dir
+    import data_scraper_v4
+    import metrics
+    from concurrency_controller import get_controller
+    from http_session import get_session
+
+    if db == "null":
+        data_scraper_v4.connect = NullConnection
+        data_scraper_v4.get_writer_pool = NullPool
+    summary = data_scraper_v4.main()
+    outcomes = {}
+    for sample in metrics.snapshot():
+        if sample["name"] == "scraper_http_requests_total":
+            outcome = sample["labels"]["outcome"]
+            outcomes[outcome] = outcomes.get(outcome, 0) + sample["value"]
+    controller = get_controller().stats()
+    results.put({
+        "units": summary["units"],
+        "records": summary["records"],
+        "elapsed": summary["elapsed"],
+        "rows_per_second": summary["records"] / summary["elapsed"] if summary["elapsed"] else 0.0,
+        "p50_latency": metrics.quantile("scraper_http_request_seconds", 0.5),
+        "p99_latency": metrics.quantile("scraper_http_request_seconds", 0.99),
+        "outcomes": outcomes,
+        "http": get_session().connection_stats(),
+        "concurrency_limit": controller["limit"],
+        "concurrency_decreases": controller["decreases"],
+        "failed": summary["failed"],
+        "peak_rss_mb": peak_rss_mb(),
+    })
+
+
+def run_load_test(args):
+    server = multiprocessing.Process(
+        target=stand_in_server.serve,
+        args=(args.port, args.issuers, args.latency, args.years, stand_in_server.faults_from_args(args)),
+        daemon=True)
+    server.start()
+    time.sleep(SERVER_STARTUP)
+    try:
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            results = multiprocessing.Queue()
+            scraper = multiprocessing.Process(
+                target=run_scraper, args=(stand_in_server.base_url_for(args.port), args.db, metrics_dir, results))
+            scraper.start()
+            while True:
+                try:
+                    result = results.get(timeout=1)
+                    break
+                except queue.Empty:
+                    if not scraper.is_alive():
+                        raise SystemExit(f"Scraper exited with code {scraper.exitcode} before reporting")
+            scraper.join()
+    finally:
+        server.terminate()
+        server.join()
+    return result
+
+
+def report(result):
+    def ms(seconds):
+        return "-" if seconds is None else f"{seconds * 1000:.0f} ms"
+
+    http = result["http"]
+    print(f"Rows: {result['records']} from {result['units']} ranges in {result['elapsed']:.2f}s "
+          f"({result['rows_per_second']:,.0f} rows/s)")
+    print(f"HTTP latency: p50 {ms(result['p50_latency'])}, p99 {ms(result['p99_latency'])}")
+    print(f"HTTP attempts: {', '.join(f'{count} {outcome}' for outcome, count in sorted(result['outcomes'].items()))}; "
+          f"{http['retries']} retries, {http['failures']} failures, {http['connections']} connections")
+    print(f"Concurrency: final limit {result['concurrency_limit']}, {result['concurrency_decreases']} decreases")
+    print(f"Peak RSS: {result['peak_rss_mb']:.1f} MiB")
+    print(f"Failed ranges: {len(result['failed'])}")
+    for issuer, range_start, range_end in result["failed"]:
+        print(f"  {issuer} {range_start} - {range_end}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test data_scraper_v4 against the stand-in MSE server")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--issuers", type=int, default=20)
+    parser.add_argument("--db", choices=("null", "env"), default="null",
+                        help="null discards every write, env uses the database configured in .env")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    stand_in_server.add_fault_arguments(parser)
+    parser.set_defaults(years=10)
+    args = parser.parse_args()
+
+    print(f"{args.issuers} issuers x {args.years:g} years, latency {args.latency:.3f}s {args.latency_distribution}, "
+          f"errors {args.error_rate:.0%}, slow {args.slow_rate:.0%}, truncated {args.truncate_rate:.0%}, "
+          f"rate limit {args.rate_limit or 'none'}")
+    result = run_load_test(args)
+    report(result)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"time": time.time(), "settings": vars(args), "results": result}, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
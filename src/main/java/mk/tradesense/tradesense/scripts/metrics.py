@@ -0,0 +1,198 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# In-process counters, gauges and latency histograms for the scraping
+# pipeline. Stages record into one registry while a run goes on; at the end
+# of the run emit_run() appends every sample to a JSON lines log and rewrites
+# a Prometheus text-format file (node_exporter's textfile collector can pick
+# it up). Counters keep growing across the runs of one process, as
+# Prometheus expects. A log that reaches METRICS_LOG_MAX_BYTES is moved to
+# <job>.jsonl.1 (replacing the one before) so a long-running daemon keeps at
+# most two of them.
+
+METRICS_DIR = os.getenv("SCRAPER_METRICS_DIR", os.path.join(os.path.expanduser("~"), ".cache", "tradesense", "metrics"))
+METRICS_LOG_MAX_BYTES = int(os.getenv("SCRAPER_METRICS_LOG_MAX_BYTES", str(64 * 1024 * 1024)))
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+HELP = {
+    "scraper_stage_seconds": "Time spent per pipeline stage call",
+    "scraper_rows_total": "Rows that passed through each pipeline stage",
+    "scraper_http_request_seconds": "Latency of single HTTP attempts",
+    "scraper_http_requests_total": "HTTP attempts by outcome",
+    "scraper_http_bytes_total": "Response body bytes downloaded",
+    "scraper_http_retries_total": "HTTP attempts retried after an error, 5xx or 429",
+    "scraper_cache_requests_total": "Response cache lookups by result",
+    "scraper_queue_depth": "Batches waiting in the writer queue",
+    "scraper_queue_depth_peak": "Highest writer queue depth seen",
+    "scraper_concurrency_limit": "Current in-flight request limit",
+    "scraper_run_seconds": "Duration of the last run",
+    "scraper_runs_total": "Completed scraper runs",
+}
+
+_lock = threading.Lock()
+_metrics = {}
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _series(name, kind):
+    metric = _metrics.get(name)
+    if metric is None:
+        metric = _metrics[name] = {"type": kind, "samples": {}}
+    return metric["samples"]
+
+
+def inc(name, value=1, **labels):
+    with _lock:
+        samples = _series(name, "counter")
+        key = _labels_key(labels)
+        samples[key] = samples.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _series(name, "gauge")[_labels_key(labels)] = value
+
+
+def max_gauge(name, value, **labels):
+    with _lock:
+        samples = _series(name, "gauge")
+        key = _labels_key(labels)
+        if value > samples.get(key, float("-inf")):
+            samples[key] = value
+
+
+def observe(name, value, **labels):
+    with _lock:
+        samples = _series(name, "histogram")
+        key = _labels_key(labels)
+        histogram = samples.get(key)
+        if histogram is None:
+            histogram = samples[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "count": 0, "sum": 0.0}
+        index = bisect.bisect_left(LATENCY_BUCKETS, value)
+        if index < len(LATENCY_BUCKETS):
+            histogram["buckets"][index] += 1
+        histogram["count"] += 1
+        histogram["sum"] += value
+
+
+@contextmanager
+def timed(stage, name="scraper_stage_seconds", **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, stage=stage, **labels)
+
+
+def add_rows(stage, count):
+    inc("scraper_rows_total", count, stage=stage)
+
+
+def quantile(name, q, **labels):
+    # Estimated from the buckets like Prometheus' histogram_quantile, over
+    # every series of `name` whose labels include `labels`; None if empty
+    with _lock:
+        metric = _metrics.get(name)
+        counts = [0] * len(LATENCY_BUCKETS)
+        total = 0
+        for key, histogram in (metric["samples"].items() if metric else ()):
+            if all(dict(key).get(label) == value for label, value in labels.items()):
+                counts = [count + added for count, added in zip(counts, histogram["buckets"])]
+                total += histogram["count"]
+    if not total:
+        return None
+    rank = q * total
+    cumulative = 0
+    lower = 0.0
+    for bound, count in zip(LATENCY_BUCKETS, counts):
+        if count and cumulative + count >= rank:
+            return lower + (bound - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = bound
+    # Above the last bucket, as histogram_quantile reports it
+    return LATENCY_BUCKETS[-1]
+
+
+def snapshot():
+    # [{"name", "type", "labels", "value"}], histograms with cumulative buckets
+    samples = []
+    with _lock:
+        for name, metric in sorted(_metrics.items()):
+            for key, value in sorted(metric["samples"].items()):
+                sample = {"name": name, "type": metric["type"], "labels": dict(key)}
+                if metric["type"] == "histogram":
+                    cumulative = 0
+                    buckets = {}
+                    for bound, count in zip(LATENCY_BUCKETS, value["buckets"]):
+                        cumulative += count
+                        buckets[str(bound)] = cumulative
+                    sample.update(count=value["count"], sum=value["sum"], buckets=buckets)
+                else:
+                    sample["value"] = value
+                samples.append(sample)
+    return samples
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels.items()) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in items)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + "}"
+
+
+def prometheus_text(samples=None):
+    lines = []
+    seen = set()
+    for sample in snapshot() if samples is None else samples:
+        name = sample["name"]
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} {sample['type']}")
+        labels = sample["labels"]
+        if sample["type"] == "histogram":
+            for bound, count in sample["buckets"].items():
+                lines.append(f"{name}_bucket{_format_labels(labels, {'le': bound})} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, {'le': '+Inf'})} {sample['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {sample['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {sample['count']}")
+        else:
+            lines.append(f"{name}{_format_labels(labels)} {sample['value']}")
+    return "\n".join(lines) + "\n"
+
+
+def _rotate(path, max_bytes):
+    try:
+        if os.path.getsize(path) >= max_bytes:
+            os.replace(path, f"{path}.1")
+    except FileNotFoundError:
+        pass
+
+
+def emit_run(job, elapsed, directory=METRICS_DIR, max_log_bytes=METRICS_LOG_MAX_BYTES, **fields):
+    # One JSON line per sample, tagged with the run, appended to <job>.jsonl,
+    # and <job>.prom rewritten with the current values
+    inc("scraper_runs_total", job=job)
+    set_gauge("scraper_run_seconds", elapsed, job=job)
+    samples = snapshot()
+    os.makedirs(directory, exist_ok=True)
+    run = {"job": job, "time": time.time(), "elapsed": elapsed, **fields}
+    log_path = os.path.join(directory, f"{job}.jsonl")
+    _rotate(log_path, max_log_bytes)
+    with open(log_path, "a", encoding="utf-8") as log:
+        log.write(json.dumps({"event": "run", **run}) + "\n")
+        for sample in samples:
+            log.write(json.dumps({"event": "metric", "job": job, "time": run["time"], **sample}) + "\n")
+    prom_path = os.path.join(directory, f"{job}.prom")
+    with open(f"{prom_path}.tmp", "w", encoding="utf-8") as prom:
+        prom.write(prometheus_text(samples))
+    os.replace(f"{prom_path}.tmp", prom_path)
+    return prom_path
@@ -0,0 +1,106 @@
+from datetime import datetime
+
+import numpy as np
+
+import metrics
+from stock_row import STOCK_COLUMNS
+
+# Column-wise conversion of scraped Macedonian-formatted strings
+# ("1.234,56", "31.12.2024") into typed NumPy arrays, one vectorized pass per
+# column instead of float()/strptime() per cell.
+
+NUMERIC_FIELDS = STOCK_COLUMNS[2:]
+# Empty cells become NULL, except percent change, which has always been stored as 0.
+EMPTY_DEFAULTS = {"percent_change": 0.0}
+
+
+def _strings(values):
+    raw = np.asarray(values, dtype=object)
+    empty = (raw == None) | (raw == "")  # noqa: E711 - elementwise comparison
+    raw[empty] = ""
+    return raw.astype(str), empty
+
+
+def parse_mk_numbers(values, empty_value=np.nan):
+    # Two str.replace calls over the whole column instead of two per cell;
+    # "1.234,56\n\n7,5" -> "1234.56\nnan\n7.5".
+    text = "\n".join([value or "nan" for value in values]).replace(".", "").replace(",", ".")
+    numbers = np.fromiter(map(float, text.split("\n")), dtype=np.float64, count=len(values))
+    if not np.isnan(empty_value):
+        numbers[np.isnan(numbers)] = empty_value
+    return numbers
+
+
+def parse_mk_dates(values):
+    strings, empty = _strings(values)
+    dates = np.full(len(strings), np.datetime64("NaT"), dtype="datetime64[D]")
+    if not len(strings):
+        return dates
+
+    # "dd.mm.yyyy" -> "yyyy-mm-dd" by rearranging characters, then one cast.
+    fast = (np.char.str_len(strings) == 10) & ~empty
+    chars = np.ascontiguousarray(strings[fast].astype("U10")).view("U1").reshape(-1, 10)
+    iso = np.empty_like(chars)
+    iso[:, 0:4] = chars[:, 6:10]
+    iso[:, 4] = "-"
+    iso[:, 5:7] = chars[:, 3:5]
+    iso[:, 7] = "-"
+    iso[:, 8:10] = chars[:, 0:2]
+    dates[fast] = iso.view("U10").ravel().astype("datetime64[D]")
+
+    # Non-padded dates such as "1.2.2024" are rare; parse them one by one.
+    for i in np.flatnonzero(~fast & ~empty):
+        dates[i] = np.datetime64(datetime.strptime(strings[i], "%d.%m.%Y").date(), "D")
+    return dates
+
+
+def format_mk_dates(dates):
+    # datetime64[D] -> "dd.mm.yyyy", the inverse of parse_mk_dates
+    if not len(dates):
+        return np.empty(0, dtype="U10")
+    iso = np.datetime_as_string(dates.astype("datetime64[D]"), unit="D")
+    chars = np.ascontiguousarray(iso.astype("U10")).view("U1").reshape(-1, 10)
+    mk = np.empty_like(chars)
+    mk[:, 0:2] = chars[:, 8:10]
+    mk[:, 2] = "."
+    mk[:, 3:5] = chars[:, 5:7]
+    mk[:, 5] = "."
+    mk[:, 6:10] = chars[:, 0:4]
+    return mk.view("U10").ravel()
+
+
+def normalize_batch(columns):
+    # columns: {"stock_code": [...], "date": [...], <numeric field>: [...]}
+    batch = {
+        "stock_code": np.asarray(columns["stock_code"], dtype=object),
+        "date": parse_mk_dates(columns["date"]),
+    }
+    for field in NUMERIC_FIELDS:
+        batch[field] = parse_mk_numbers(columns[field], EMPTY_DEFAULTS.get(field, np.nan))
+    return batch
+
+
+def sort_order(batch):
+    # Issuer, then date; missing dates first like the old datetime.min sort key.
+    return np.lexsort((batch["date"].view(np.int64), batch["stock_code"].astype(str)))
+
+
+def _nullable(values):
+    column = values.astype(object)
+    column[np.isnan(values)] = None
+    return column
+
+
+def to_db_rows(batch, order=None):
+    if order is None:
+        order = sort_order(batch)
+    columns = [batch["stock_code"][order], batch["date"][order].astype(object)]
+    columns.extend(_nullable(batch[field][order]) for field in NUMERIC_FIELDS)
+    return list(zip(*columns))
+
+
+def normalize_records(records):
+    if not records:
+        return []
+    with metrics.timed("normalize"):
+        return to_db_rows(normalize_batch(dict(zip(STOCK_COLUMNS, zip(*records)))))
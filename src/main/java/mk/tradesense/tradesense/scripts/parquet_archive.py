@@ -0,0 +1,184 @@
+import argparse
+import glob
+import os
+import threading
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+import metrics
+from history_reader import iter_history
+from normalizer import NUMERIC_FIELDS, normalize_batch
+from stock_row import STOCK_COLUMNS
+
+# Typed columnar copy of the scraped history, one Parquet file per issuer and
+# year laid out as <root>/stock_code=<code>/year=<yyyy>/data.parquet (the
+# hive layout pyarrow.dataset, pandas and DuckDB read directly). Writes merge
+# into the partition on date, newer rows winning, so re-scraping a range
+# rewrites instead of duplicating. The reader memory-maps the files and
+# reads only the requested columns, so research never touches Postgres.
+
+ARCHIVE_DIR = os.getenv("SCRAPER_ARCHIVE_DIR")
+FILE_NAME = "data.parquet"
+COMPRESSION = "zstd"
+
+
+def archive_schema():
+    return pa.schema([("date", pa.date32())] + [(field, pa.float64()) for field in NUMERIC_FIELDS])
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("The Parquet archive needs pyarrow (pip install pyarrow)")
+
+
+def partition_path(root, stock_code, year):
+    return os.path.join(root, f"stock_code={stock_code}", f"year={year}", FILE_NAME)
+
+
+def _partition_table(batch, rows):
+    # from_pandas=True stores NaN (an empty cell) as null
+    return pa.table([pa.array(batch["date"][rows])] + [pa.array(batch[field][rows], from_pandas=True) for field in NUMERIC_FIELDS],
+                    schema=archive_schema())
+
+
+def _merge(existing, table):
+    # Newer rows win on equal dates: a stable sort keeps them after the old ones
+    combined = pa.concat_tables([existing, table])
+    dates = combined.column("date").to_numpy().astype("datetime64[D]")
+    order = np.argsort(dates, kind="stable")
+    sorted_dates = dates[order]
+    keep = np.append(sorted_dates[1:] != sorted_dates[:-1], True)
+    return combined.take(pa.array(order[keep]))
+
+
+def write_partition(root, stock_code, year, table):
+    path = partition_path(root, stock_code, year)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        table = _merge(pq.read_table(path, memory_map=True), table)
+    else:
+        table = table.take(pa.array(np.argsort(table.column("date").to_numpy(), kind="stable")))
+    # Write beside the old file and swap, so readers never see half a file
+    temp_path = f"{path}.tmp"
+    pq.write_table(table, temp_path, compression=COMPRESSION)
+    os.replace(temp_path, path)
+    return table.num_rows
+
+
+def partitions(batch):
+    # (stock_code, year, row indices) of a normalized batch; undated rows are skipped
+    dated = np.flatnonzero(~np.isnat(batch["date"]))
+    years = batch["date"][dated].astype("datetime64[Y]").astype(int) + 1970
+    codes = batch["stock_code"][dated].astype(str)
+    for stock_code, year in sorted(set(zip(codes.tolist(), years.tolist()))):
+        yield stock_code, year, dated[(codes == stock_code) & (years == year)]
+
+
+def write_batch(root, batch):
+    # batch: typed columns as returned by normalizer.normalize_batch
+    _require_pyarrow()
+    written = 0
+    for stock_code, year, rows in partitions(batch):
+        write_partition(root, stock_code, year, _partition_table(batch, rows))
+        written += len(rows)
+    return written
+
+
+class ArchiveWriter:
+    # Archives scraped StockRows from many fetch threads; one lock per partition file
+    def __init__(self, root=ARCHIVE_DIR):
+        _require_pyarrow()
+        self.root = root
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        self.rows_written = 0
+
+    def _lock(self, stock_code, year):
+        with self.locks_lock:
+            return self.locks.setdefault((stock_code, year), threading.Lock())
+
+    def add(self, records):
+        if not records:
+            return
+        batch = normalize_batch(dict(zip(STOCK_COLUMNS, zip(*records))))
+        for stock_code, year, rows in partitions(batch):
+            with self._lock(stock_code, year), metrics.timed("archive"):
+                write_partition(self.root, stock_code, year, _partition_table(batch, rows))
+            with self.locks_lock:
+                self.rows_written += len(rows)
+
+    def report(self):
+        return f"Archived {self.rows_written} rows under {self.root}"
+
+
+def list_issuers(root):
+    return sorted(name.split("=", 1)[1] for name in os.listdir(root) if name.startswith("stock_code="))
+
+
+def read_archive(root, issuers=None, columns=None, years=None):
+    # One pyarrow Table for the given issuers (all by default), with only the
+    # requested columns; stock_code comes from the partition path.
+    _require_pyarrow()
+    if isinstance(issuers, str):
+        issuers = [issuers]
+    columns = list(columns) if columns is not None else list(archive_schema().names)
+    file_columns = [column for column in columns if column != "stock_code"]
+    tables = []
+    for stock_code in issuers if issuers is not None else list_issuers(root):
+        for path in sorted(glob.glob(partition_path(root, stock_code, "*"))):
+            year = int(os.path.basename(os.path.dirname(path)).split("=", 1)[1])
+            if years is not None and year not in years:
+                continue
+            table = pq.read_table(path, columns=file_columns, memory_map=True)
+            if "stock_code" in columns:
+                table = table.append_column("stock_code", pa.array([stock_code] * table.num_rows, pa.string()))
+            tables.append(table.select(columns))
+    if not tables:
+        schema = archive_schema()
+        return pa.schema([pa.field("stock_code", pa.string()) if column == "stock_code" else schema.field(column)
+                          for column in columns]).empty_table()
+    return pa.concat_tables(tables)
+
+
+def read_columns(root, issuers=None, columns=None, years=None):
+    # Same as read_archive, as NumPy arrays keyed by column name
+    table = read_archive(root, issuers, columns, years)
+    return {name: table.column(name).to_numpy() for name in table.column_names}
+
+
+def export_table(conn, root, table="stock_items", chunk_rows=200000):
+    _require_pyarrow()
+    exported = 0
+    for batch in iter_history(conn, table, chunk_rows=chunk_rows):
+        exported += write_batch(root, batch)
+    return exported
+
+
+def main():
+    import psycopg2
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Export stock history from Postgres into the Parquet archive")
+    parser.add_argument("--table", default="stock_items", choices=["stock_items", "stock_prices"])
+    parser.add_argument("--dir", default=ARCHIVE_DIR or "archive")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(
+        dbname=os.getenv("DB_NAME"), user=os.getenv("DB_USER"), password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"), port=os.getenv("DB_PORT"))
+    try:
+        print(f"Exported {export_table(conn, args.dir, args.table)} rows from {args.table} to {args.dir}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from stock_row import row_from_cells
+from table_parser import parse_results_table
+
+# Parses downloaded symbolhistory pages in a pool of worker processes, so the
+# pure-Python parsing runs on every core instead of queueing for the GIL
+# behind the fetch threads, which then only download bytes. A fetch thread
+# hands its page to parse() and waits for the StockRow list without holding
+# the GIL. Workers are spawned rather than forked: the scraper already runs
+# fetch, writer and daemon threads when the pool starts. With
+# SCRAPER_PARSE_WORKERS=0 pages are parsed in the calling thread, which is
+# also the default on a single core, where a pool only adds pickling.
+
+CPU_COUNT = os.cpu_count() or 1
+PARSE_WORKERS = int(os.getenv("SCRAPER_PARSE_WORKERS", str(CPU_COUNT if CPU_COUNT > 1 else 0)))
+
+
+def parse_page(issuer, content, backend=None):
+    # Runs in a worker; returns the rows and the CPU seconds spent on them,
+    # which unlike wall time leaves out waiting for the GIL
+    started = time.thread_time()
+    # A stray byte becomes U+FFFD, as response.text had it, instead of failing the unit
+    html = content.decode("utf-8", errors="replace") if isinstance(content, bytes) else content
+    rows = [row_from_cells(issuer, cells) for cells in parse_results_table(html, backend)]
+    return rows, time.thread_time() - started
+
+
+class ParsePool:
+    def __init__(self, workers=PARSE_WORKERS, backend=None):
+        self.workers = workers
+        self.backend = backend
+        self.executor = None
+        if workers > 0:
+            self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # Counters start over for each run a long-lived pool serves
+        with self.lock:
+            self.pages = 0
+            self.rows = 0
+            self.parse_seconds = 0.0
+
+    def parse(self, issuer, content):
+        if self.executor is None:
+            rows, seconds = parse_page(issuer, content, self.backend)
+        else:
+            rows, seconds = self.executor.submit(parse_page, issuer, content, self.backend).result()
+        metrics.observe("scraper_stage_seconds", seconds, stage="parse")
+        metrics.add_rows("parsed", len(rows))
+        with self.lock:
+            self.pages += 1
+            self.rows += len(rows)
+            self.parse_seconds += seconds
+        return rows
+
+    def report(self):
+        where = f"{self.workers} worker processes" if self.executor is not None else "the fetch threads"
+        rate = self.rows / self.parse_seconds if self.parse_seconds else 0.0
+        return (f"Parsed {self.pages} pages ({self.rows} rows) in {where}, "
+                f"{self.parse_seconds:.2f} CPU seconds ({rate:,.0f} rows/s per core)")
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,135 @@
+import os
+import threading
+from datetime import date, timedelta
+
+# Chooses the date windows each issuer is fetched in. Windows are whole
+# blocks of 1, 3, 6, 12, 24, 60 or 120 months aligned on the calendar
+# (quarters, years, even years, ...), clipped to the requested period, so
+# they always tile it exactly and a past window keeps the same cache key
+# from run to run. Each issuer gets the widest block whose expected page
+# stays under TARGET_PAGE_ROWS, from its trading density in the DB: a liquid
+# issuer is fetched a year or two at a time, one that barely trades in a
+# single request. A page that comes back bigger than planned is kept; its
+# size only raises the issuer's density for windows planned afterwards.
+# Windows that time out are split into the next smaller blocks and fetched
+# again, at most MAX_SPLIT_DEPTH times over, so a server that keeps timing
+# out is not asked for ever smaller windows down to single days.
+
+BLOCK_MONTHS = (1, 3, 6, 12, 24, 60, 120)
+DEFAULT_BLOCK_MONTHS = 12
+DAYS_PER_MONTH = 365.25 / 12
+
+TARGET_PAGE_ROWS = int(os.getenv("SCRAPER_TARGET_PAGE_ROWS", "500"))
+MAX_BLOCK_MONTHS = int(os.getenv("SCRAPER_MAX_WINDOW_MONTHS", "120"))
+MAX_SPLIT_DEPTH = int(os.getenv("SCRAPER_MAX_SPLIT_DEPTH", "4"))
+
+
+def _month_index(day):
+    return day.year * 12 + day.month - 1
+
+
+def _month_start(month_index):
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def tile(start_date, end_date, months):
+    # Calendar-aligned blocks of `months` months covering start_date..end_date
+    windows = []
+    block = _month_index(start_date) // months
+    while True:
+        block_start = _month_start(block * months)
+        block_end = _month_start((block + 1) * months) - timedelta(days=1)
+        windows.append((max(start_date, block_start), min(end_date, block_end)))
+        if block_end >= end_date:
+            return windows
+        block += 1
+
+
+def yearly_window_count(start_date, end_date):
+    return end_date.year - start_date.year + 1
+
+
+class RangePlanner:
+    def __init__(self, densities=None, target_rows=TARGET_PAGE_ROWS, max_months=MAX_BLOCK_MONTHS,
+                 max_depth=MAX_SPLIT_DEPTH):
+        # densities: {issuer: trading rows per calendar day}
+        self.densities = densities or {}
+        self.target_rows = target_rows
+        self.max_depth = max_depth
+        # How many splits produced each unit; planned units are at depth 0
+        self.depths = {}
+        self.block_months = [months for months in BLOCK_MONTHS if months <= max_months]
+        self.lock = threading.Lock()
+        self.planned = 0
+        self.baseline = 0
+        self.splits = 0
+        self.split_requests = 0
+        self.oversized = 0
+
+    def block_months_for(self, issuer):
+        density = self.densities.get(issuer)
+        if density is None:
+            return min(DEFAULT_BLOCK_MONTHS, self.block_months[-1])
+        fitting = [months for months in self.block_months if density * months * DAYS_PER_MONTH <= self.target_rows]
+        return fitting[-1] if fitting else self.block_months[0]
+
+    def plan(self, issuer, start_date, end_date):
+        if start_date > end_date:
+            return []
+        windows = tile(start_date, end_date, self.block_months_for(issuer))
+        with self.lock:
+            self.planned += len(windows)
+            self.baseline += yearly_window_count(start_date, end_date)
+        return [(issuer, *window) for window in windows]
+
+    def observe(self, unit, row_count):
+        # A page bigger than planned raises the issuer's density, so windows
+        # planned from here on are narrower; the page itself is kept
+        issuer, start_date, end_date = unit
+        if row_count <= self.target_rows:
+            return
+        density = row_count / ((end_date - start_date).days + 1)
+        with self.lock:
+            self.oversized += 1
+            if density > self.densities.get(issuer, 0.0):
+                self.densities[issuer] = density
+
+    def split(self, unit):
+        # Next smaller aligned blocks inside the window, halves below one
+        # month, or [] for a single day or a unit already split max_depth times
+        issuer, start_date, end_date = unit
+        with self.lock:
+            depth = self.depths.get(unit, 0)
+        if depth >= self.max_depth:
+            return []
+        windows = []
+        for months in reversed(self.block_months):
+            windows = tile(start_date, end_date, months)
+            if len(windows) > 1:
+                break
+        if len(windows) < 2:
+            if start_date == end_date:
+                return []
+            middle = start_date + (end_date - start_date) // 2
+            windows = [(start_date, middle), (middle + timedelta(days=1), end_date)]
+        smaller_units = [(issuer, *window) for window in windows]
+        with self.lock:
+            self.splits += 1
+            self.split_requests += len(windows)
+            for smaller_unit in smaller_units:
+                self.depths[smaller_unit] = depth + 1
+        return smaller_units
+
+    def requests_saved(self):
+        return self.baseline - self.planned - self.split_requests
+
+    def report(self):
+        return (f"Planned {self.planned} windows instead of {self.baseline} yearly ones, "
+                f"split {self.splits} into {self.split_requests} more: {self.requests_saved()} requests saved, "
+                f"{self.oversized} pages over {self.target_rows} rows")
+
+
+def densities_from_history(history):
+    # history: {issuer: (first_date, last_date, row_count)}
+    return {issuer: row_count / ((last_date - first_date).days + 1)
+            for issuer, (first_date, last_date, row_count) in history.items() if row_count}
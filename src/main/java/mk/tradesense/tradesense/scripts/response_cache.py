@@ -0,0 +1,138 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import date
+
+import metrics
+
+# Local cache of symbolhistory pages keyed by (issuer, FromDate, ToDate).
+# Past trading days never change, so a range that ends before today is kept
+# for good; a range that includes today expires after TTL seconds. Raw
+# response bodies are zlib-compressed into one SQLite file, and the least
+# recently used entries are evicted once the file grows past MAX_BYTES. In
+# offline mode nothing goes to the network: every entry is served regardless
+# of age and a missing one raises CacheMiss, so a full history can be
+# re-ingested from disk.
+
+CACHE_MODE = os.getenv("SCRAPER_CACHE_MODE", "on")
+CACHE_DIR = os.getenv("SCRAPER_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "tradesense"))
+CACHE_MAX_BYTES = int(float(os.getenv("SCRAPER_CACHE_MAX_MB", "1024")) * 1024 * 1024)
+CACHE_TTL = float(os.getenv("SCRAPER_CACHE_TTL", "900"))
+COMPRESS_LEVEL = 6
+
+
+class CacheMiss(Exception):
+    pass
+
+
+def is_closed_range(end_date, today=None):
+    return end_date < (today or date.today())
+
+
+class ResponseCache:
+    def __init__(self, path=os.path.join(CACHE_DIR, "responses.sqlite3"), max_bytes=CACHE_MAX_BYTES,
+                 ttl=CACHE_TTL, offline=CACHE_MODE == "offline"):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                closed INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                used_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)")
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT body, closed, fetched_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and (self.offline or row[1] or now - row[2] < self.ttl):
+                self.conn.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, key))
+                self.hits += 1
+                metrics.inc("scraper_cache_requests_total", result="hit")
+                return zlib.decompress(row[0])
+            self.misses += 1
+            metrics.inc("scraper_cache_requests_total", result="miss")
+        if self.offline:
+            raise CacheMiss(f"{key} is not cached")
+        return None
+
+    def put(self, key, content, closed):
+        body = zlib.compress(content, COMPRESS_LEVEL)
+        now = time.time()
+        with self.lock:
+            previous = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, body, size, closed, fetched_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (key, body, len(body), int(closed), now, now))
+            self.total_bytes += len(body) - (previous[0] if previous else 0)
+            self.stored += 1
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def fetch(self, key, closed, download):
+        # Cached bytes for key, or download() stored under it
+        content = self.get(key)
+        if content is None:
+            content = download()
+            self.put(key, content, closed)
+        return content
+
+    def _evict(self):
+        # Trim to 90% of the cap so a full cache does not evict on every put
+        target = self.max_bytes * 0.9
+        evicted_keys = []
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY used_at"):
+            if self.total_bytes <= target:
+                break
+            evicted_keys.append((key,))
+            self.total_bytes -= size
+        self.conn.execute("BEGIN")
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", evicted_keys)
+        self.conn.execute("COMMIT")
+        self.evicted += len(evicted_keys)
+
+    def report(self):
+        return (f"Response cache: {self.hits} hits, {self.misses} misses, {self.stored} stored, "
+                f"{self.evicted} evicted, {self.total_bytes / 1024 / 1024:.1f} MiB")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    # None when caching is switched off
+    global _cache
+    if CACHE_MODE == "off":
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
+
+
+def cache_key(*parts):
+    return "|".join(parts)
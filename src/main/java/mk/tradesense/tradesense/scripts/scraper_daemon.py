@@ -0,0 +1,193 @@
+import json
+import os
+import signal
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import data_scraper_v4
+import metrics
+from concurrency_controller import get_controller
+from http_session import get_session
+from parse_pool import ParsePool
+
+# Long-lived scraper process: imports, the pooled HTTP session, the DB
+# connection, the parse worker processes and the issuer list are set up
+# once and kept warm, and
+# incremental refreshes run on a fixed interval. A local HTTP endpoint
+# triggers a refresh on demand and reports status:
+#   POST /refresh  queue a refresh (runs right away unless one is running)
+#   GET  /status   JSON with the current state and the last run's summary
+#   GET  /metrics  the pipeline metrics in Prometheus text format
+# Refreshes run one at a time on a single worker thread. SIGTERM (what
+# DataLoader's process.destroy() sends) shuts down like Ctrl-C, closing the
+# connections and the worker processes.
+
+DAEMON_HOST = os.getenv("SCRAPER_DAEMON_HOST", "127.0.0.1")
+DAEMON_PORT = int(os.getenv("SCRAPER_DAEMON_PORT", "8765"))
+REFRESH_INTERVAL = float(os.getenv("SCRAPER_REFRESH_INTERVAL", "3600"))
+ISSUERS_INTERVAL = float(os.getenv("SCRAPER_ISSUERS_INTERVAL", "86400"))
+
+
+class ScraperDaemon:
+    def __init__(self, refresh_interval=REFRESH_INTERVAL, issuers_interval=ISSUERS_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.issuers_interval = issuers_interval
+        self.trigger = threading.Event()
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.conn = None
+        self.parse_pool = None
+        self.issuers_loaded_at = None
+        self.state = "starting"
+        self.started_at = time.time()
+        self.next_run_at = self.started_at
+        self.runs = 0
+        self.failures = 0
+        self.last_run = None
+        self.last_error = None
+        self.thread = threading.Thread(target=self._loop, name="scraper-refresh", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def request_refresh(self):
+        self.trigger.set()
+
+    def stop(self):
+        self.stopping.set()
+        self.trigger.set()
+        self.thread.join()
+        if self.conn is not None:
+            self.conn.close()
+        if self.parse_pool is not None:
+            self.parse_pool.close()
+        data_scraper_v4.close_writer_pool()
+
+    def _connection(self):
+        # Reconnect only when the previous connection was lost
+        if self.conn is None or self.conn.closed:
+            self.conn = data_scraper_v4.connect()
+        return self.conn
+
+    def _parse_pool(self):
+        # Started on the first refresh, after the server is bound
+        if self.parse_pool is None:
+            self.parse_pool = ParsePool()
+        return self.parse_pool
+
+    def _issuers(self):
+        if self.issuers_loaded_at is None or time.time() - self.issuers_loaded_at >= self.issuers_interval:
+            data_scraper_v4.issuers_data.clear()
+            data_scraper_v4.get_issuers()
+            self.issuers_loaded_at = time.time()
+        return data_scraper_v4.issuers_data
+
+    def refresh(self):
+        with self.lock:
+            self.state = "running"
+        try:
+            summary = data_scraper_v4.run_refresh(self._connection(), self._issuers(), self._parse_pool())
+            with self.lock:
+                self.runs += 1
+                self.last_run = summary
+                self.last_error = None
+        except Exception as e:
+            traceback.print_exc()
+            if self.conn is not None and not self.conn.closed:
+                self.conn.rollback()
+            with self.lock:
+                self.failures += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+        finally:
+            with self.lock:
+                self.state = "idle"
+                self.next_run_at = time.time() + self.refresh_interval
+
+    def _loop(self):
+        while not self.stopping.is_set():
+            self.trigger.clear()
+            self.refresh()
+            self.trigger.wait(max(0.0, self.next_run_at - time.time()))
+
+    def status(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "started_at": self.started_at,
+                "next_run_at": self.next_run_at,
+                "refresh_queued": self.trigger.is_set(),
+                "runs": self.runs,
+                "failures": self.failures,
+                "issuers": len(data_scraper_v4.issuers_data),
+                "issuers_loaded_at": self.issuers_loaded_at,
+                "last_run": self.last_run,
+                "last_error": self.last_error,
+                "http": get_session().connection_stats(),
+                "concurrency": get_controller().stats(),
+            }
+
+
+class DaemonHandler(BaseHTTPRequestHandler):
+    def _send_json(self, status, body):
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path == "/status":
+            self._send_json(200, self.server.scraper.status())
+        elif self.path == "/metrics":
+            content = metrics.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path == "/refresh":
+            self.server.scraper.request_refresh()
+            self._send_json(202, {"queued": True, "state": self.server.scraper.status()["state"]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_server(daemon, host=DAEMON_HOST, port=DAEMON_PORT):
+    server = ThreadingHTTPServer((host, port), DaemonHandler)
+    server.scraper = daemon
+    return server
+
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def main():
+    signal.signal(signal.SIGTERM, _terminate)
+    daemon = ScraperDaemon()
+    # Bind first, so a second instance exits before touching the DB or the site
+    server = create_server(daemon)
+    print(f"Scraper daemon listening on http://{DAEMON_HOST}:{server.server_address[1]}, "
+          f"refreshing every {daemon.refresh_interval:.0f}s")
+    daemon.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.stop()
+
+
+if __name__ == "__main__":
+    main()
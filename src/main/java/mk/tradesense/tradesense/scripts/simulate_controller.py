@@ -0,0 +1,103 @@
+import argparse
+import random
+
+from concurrency_controller import OK, ConcurrencyController
+
+# Drives ConcurrencyController on a virtual clock, one round of `limit`
+# requests at a time, against modelled servers, and exits 1 if it reacts
+# to the wrong thing:
+#   - heavy-tailed: lognormal latency that does not depend on the load; a
+#     long tail on its own must not drive the limit down
+#   - saturating: a server with CAPACITY requests' worth of workers, whose
+#     latency grows with the requests queued past them; the limit must be
+#     held well under the maximum
+#   - slower for good: heavy-tailed latency that triples a quarter of the way
+#     in; the limit may dip but must climb back
+# Run after changing the controller's latency or error rules.
+
+ROUNDS = 400
+MIN_LIMIT = 2
+MAX_LIMIT = 50
+CAPACITY = 10
+MEDIAN_LATENCY = 0.1
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def heavy_tailed(sigma):
+    def latency(rng, in_flight, round_index):
+        return rng.lognormvariate(0.0, sigma) * MEDIAN_LATENCY
+    return latency
+
+
+def saturating(sigma):
+    def latency(rng, in_flight, round_index):
+        return rng.lognormvariate(0.0, sigma) * MEDIAN_LATENCY * max(1.0, in_flight / CAPACITY)
+    return latency
+
+
+def slower_for_good(sigma):
+    def latency(rng, in_flight, round_index):
+        slowdown = 3.0 if round_index >= ROUNDS // 4 else 1.0
+        return rng.lognormvariate(0.0, sigma) * MEDIAN_LATENCY * slowdown
+    return latency
+
+
+def simulate(latency, seed, rounds=ROUNDS):
+    # Returns the limit after every round
+    rng = random.Random(seed)
+    clock = VirtualClock()
+    controller = ConcurrencyController(initial=8, min_limit=MIN_LIMIT, max_limit=MAX_LIMIT, clock=clock)
+    limits = []
+    for round_index in range(rounds):
+        in_flight = controller.limit
+        started = [controller.acquire() for _ in range(in_flight)]
+        finished = sorted(start + latency(rng, in_flight, round_index) for start in started)
+        for start, end in zip(started, finished):
+            clock.now = end
+            controller.release(start, OK)
+        limits.append(controller.limit)
+    return limits, controller
+
+
+def settled(limits):
+    second_half = limits[len(limits) // 2:]
+    return sum(second_half) / len(second_half)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the concurrency controller against modelled servers")
+    parser.add_argument("--seeds", type=int, default=5, help="runs per scenario")
+    args = parser.parse_args()
+
+    # (name, latency model, sigmas, whether the limit should settle high)
+    scenarios = [
+        ("heavy-tailed", heavy_tailed, (0.5, 1.0, 1.5), True),
+        ("saturating", saturating, (0.3, 1.0), False),
+        ("slower for good", slower_for_good, (0.5, 1.0), True),
+    ]
+    failures = []
+    for name, model, sigmas, settles_high in scenarios:
+        for sigma in sigmas:
+            for seed in range(args.seeds):
+                limits, controller = simulate(model(sigma), seed)
+                line = (f"{name} sigma {sigma} seed {seed}: settled at {settled(limits):.1f}, "
+                        f"{controller.decreases} decreases")
+                print(line)
+                if (settled(limits) >= 0.7 * MAX_LIMIT) != settles_high:
+                    failures.append(line)
+
+    if failures:
+        raise SystemExit(f"{len(failures)} runs settled on the wrong side of {0.7 * MAX_LIMIT:.0f}:\n"
+                         + "\n".join(failures))
+    print("Controller OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import argparse
+import math
+import random
+import socket
+import threading
+import time
+from datetime import date, datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, unquote
+
+# Local stand-in for the mse.mk symbolhistory pages, used to exercise the
+# scrapers without touching the real exchange. Rows are generated
+# deterministically from (issuer, day), so repeated runs return the same data.
+# Faults can be injected to load-test the scraper: latency drawn from a
+# distribution, 500s, bodies trickled slowly or cut off halfway, and a
+# requests-per-second limit answered with 429.
+
+PATH_PREFIX = "/mk/stats/symbolhistory/"
+SLOW_CHUNK_BYTES = 4096
+LOGNORMAL_SIGMA = 1.0
+
+# Each returns a delay with the given mean
+LATENCY_DISTRIBUTIONS = {
+    "fixed": lambda rng, mean: mean,
+    "uniform": lambda rng, mean: rng.uniform(0, 2 * mean),
+    "exponential": lambda rng, mean: rng.expovariate(1 / mean) if mean else 0.0,
+    "lognormal": lambda rng, mean: mean * rng.lognormvariate(-LOGNORMAL_SIGMA ** 2 / 2, LOGNORMAL_SIGMA),
+}
+
+
+def issuer_codes(count):
+    codes = []
+    for i in range(count):
+        code = ""
+        for _ in range(4):
+            code = chr(ord("A") + i % 26) + code
+            i //= 26
+        codes.append(code)
+    return codes
+
+
+def format_mk_number(value, decimals=2):
+    # 1234.5 -> "1.234,50"
+    return f"{value:,.{decimals}f}".replace(",", " ").replace(".", ",").replace(" ", ".")
+
+
+def generate_rows(issuer, start_date, end_date, trading_ratio=0.7):
+    rows = []
+    day = end_date
+    while day >= start_date:
+        rng = random.Random(f"{issuer}{day.isoformat()}")
+        if day.weekday() < 5 and rng.random() < trading_ratio:
+            avg_price = 100 + 50 * rng.random()
+            quantity = rng.randint(1, 5000)
+            turnover = avg_price * quantity
+            rows.append([
+                day.strftime("%d.%m.%Y"),
+                format_mk_number(avg_price * (1 + rng.uniform(-0.01, 0.01))),
+                format_mk_number(avg_price * 1.02) if rng.random() < 0.9 else "",
+                format_mk_number(avg_price * 0.98) if rng.random() < 0.9 else "",
+                format_mk_number(avg_price),
+                format_mk_number(rng.uniform(-5, 5)),
+                format_mk_number(quantity, 0),
+                format_mk_number(turnover, 0),
+                format_mk_number(turnover, 0),
+            ])
+        day -= timedelta(days=1)
+    return rows
+
+
+def render_symbolhistory_page(rows):
+    body_rows = "\n".join(
+        "<tr>" + "".join(f"<td>{cell}</td>" for cell in row) + "</tr>"
+        for row in rows
+    )
+    return f"""<!DOCTYPE html>
+<html lang="mk">
+<head><meta charset="utf-8"><title>Историја на симбол</title>
+<script>window.dataLayer = window.dataLayer || [];</script></head>
+<body>
+<nav class="navbar"><ul><li><a href="/mk">Почетна</a></li><li><a href="/mk/stats">Статистика</a></li></ul></nav>
+<div class="container">
+<form method="post"><input name="FromDate"><input name="ToDate"><select id="Code" name="Code"></select></form>
+<table id="resultsTable" class="table table-bordered">
+<thead><tr><th>Датум</th><th>Цена на последна трансакција</th><th>Макс.</th><th>Мин.</th><th>Просечна цена</th>
+<th>% пром.</th><th>Количина</th><th>Промет во БЕСТ во денари</th><th>Вкупен промет во денари</th></tr></thead>
+<tbody>
+{body_rows}
+</tbody>
+</table>
+</div>
+<footer><p>Македонска берза АД Скопје</p></footer>
+</body>
+</html>"""
+
+
+def render_issuers_page(issuers):
+    options = "\n".join(f'<option value="{issuer}">{issuer}</option>' for issuer in issuers)
+    return f"""<!DOCTYPE html>
+<html lang="mk"><head><meta charset="utf-8"></head>
+<body><select id="Code" name="Code">
+<option value=""></option>
+{options}
+<option value="RMDEN21">RMDEN21</option>
+</select></body></html>"""
+
+
+class Faults:
+    def __init__(self, latency=0.0, latency_distribution="fixed", error_rate=0.0, slow_rate=0.0,
+                 slow_bytes_per_second=64 * 1024, truncate_rate=0.0, rate_limit=0.0, seed=None):
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution {latency_distribution!r}")
+        self.latency = latency
+        self.latency_distribution = latency_distribution
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_bytes_per_second = slow_bytes_per_second
+        self.truncate_rate = truncate_rate
+        self.rate_limit = rate_limit
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tokens = rate_limit
+        self.refilled_at = time.monotonic()
+
+    def delay(self):
+        with self.lock:
+            return LATENCY_DISTRIBUTIONS[self.latency_distribution](self.rng, self.latency)
+
+    def roll(self, rate):
+        if not rate:
+            return False
+        with self.lock:
+            return self.rng.random() < rate
+
+    def allow(self):
+        # Token bucket holding up to one second of requests
+        if not self.rate_limit:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate_limit, self.tokens + (now - self.refilled_at) * self.rate_limit)
+            self.refilled_at = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_html(self, html, status=200, headers=None):
+        body = html.encode("utf-8")
+        faults = self.server.faults
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if status == 200 and faults.roll(faults.truncate_rate):
+            # Full Content-Length, half the body, then the connection drops
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+        elif status == 200 and faults.roll(faults.slow_rate):
+            for offset in range(0, len(body), SLOW_CHUNK_BYTES):
+                self.wfile.write(body[offset:offset + SLOW_CHUNK_BYTES])
+                self.wfile.flush()
+                time.sleep(SLOW_CHUNK_BYTES / faults.slow_bytes_per_second)
+        else:
+            self.wfile.write(body)
+
+    def inject_faults(self):
+        # True when a fault response was sent instead of the page
+        faults = self.server.faults
+        if not faults.allow():
+            self.send_html("Too many requests", status=429, headers={"Retry-After": "1"})
+            return True
+        time.sleep(faults.delay())
+        if faults.roll(faults.error_rate):
+            self.send_html("Internal server error", status=500)
+            return True
+        return False
+
+    def do_GET(self):
+        if self.inject_faults():
+            return
+        if self.path.rstrip("/") == PATH_PREFIX + "kmb":
+            self.send_html(render_issuers_page(self.server.issuers))
+        else:
+            self.send_html("Not found", status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        if self.inject_faults():
+            return
+        issuer = unquote(self.path[len(PATH_PREFIX):]).strip("/")
+        try:
+            start_date = datetime.strptime(form["FromDate"][0], "%d.%m.%Y").date()
+            end_date = datetime.strptime(form["ToDate"][0], "%d.%m.%Y").date()
+        except (KeyError, ValueError):
+            self.send_html("Bad request", status=400)
+            return
+        if self.server.history_start is not None:
+            start_date = max(start_date, self.server.history_start)
+        self.send_html(render_symbolhistory_page(generate_rows(issuer, start_date, end_date)))
+
+
+class StandInServer(ThreadingHTTPServer):
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def create_server(port=8765, issuers=20, latency=0.0, years=None, faults=None):
+    # years: trading history per issuer, unlimited by default
+    server = StandInServer(("127.0.0.1", port), StandInHandler)
+    server.issuers = issuer_codes(issuers)
+    server.faults = faults or Faults(latency=latency)
+    server.history_start = date.today() - timedelta(days=math.ceil(365.25 * years)) if years else None
+    return server
+
+
+def free_port():
+    # A port nothing listens on right now, for runs that start their own stand-in
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def base_url_for(port):
+    return f"http://127.0.0.1:{port}{PATH_PREFIX}"
+
+
+def serve(port=8765, issuers=20, latency=0.0, years=None, faults=None):
+    server = create_server(port, issuers, latency, years, faults)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def add_fault_arguments(parser):
+    parser.add_argument("--years", type=float, help="trading history per issuer, unlimited if omitted")
+    parser.add_argument("--latency", type=float, default=0.0, help="mean seconds added to every response")
+    parser.add_argument("--latency-distribution", default="fixed", choices=sorted(LATENCY_DISTRIBUTIONS))
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 500")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of bodies trickled slowly")
+    parser.add_argument("--slow-bytes-per-second", type=int, default=64 * 1024)
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="share of bodies cut off halfway")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requests/s before answering 429, 0 = none")
+    parser.add_argument("--seed", type=int, help="seed for the injected faults")
+
+
+def faults_from_args(args):
+    return Faults(args.latency, args.latency_distribution, args.error_rate, args.slow_rate,
+                  args.slow_bytes_per_second, args.truncate_rate, args.rate_limit, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the mse.mk symbolhistory pages")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--issuers", type=int, default=20)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+    print(f"Serving {args.issuers} issuers at {base_url_for(args.port)}")
+    serve(args.port, args.issuers, years=args.years, faults=faults_from_args(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+from collections import namedtuple
+
+# One scraped row. A namedtuple has no per-instance dict, so a row costs a
+# tenth-sized tuple instead of a dict with ten long Cyrillic keys, and its
+# field order is the stock_items/stock_prices column order, so rows can go
+# straight into COPY/execute_values. `zip(*rows)` turns a batch into columns.
+
+STOCK_COLUMNS = (
+    "stock_code", "date", "last_price", "max_price", "min_price", "avg_price",
+    "percent_change", "quantity", "turnover_best", "total_turnover",
+)
+
+StockRow = namedtuple("StockRow", STOCK_COLUMNS)
+
+# Column headers as they appear on mse.mk
+COLUMN_LABELS = {
+    "stock_code": "Издавач",
+    "date": "Датум",
+    "last_price": "Цена на последна трансакција",
+    "max_price": "Макс.",
+    "min_price": "Мин.",
+    "avg_price": "Просечна цена",
+    "percent_change": "% пром.",
+    "quantity": "Количина",
+    "turnover_best": "Промет во БЕСТ во денари",
+    "total_turnover": "Вкупен промет во денари",
+}
+
+
+def row_from_cells(issuer, cells):
+    # cells: the 9 stripped <td> texts of a #resultsTable row, empty -> None
+    return StockRow(issuer, *(cell or None for cell in cells))
+
+
+def to_labeled_dict(row):
+    return {COLUMN_LABELS[field]: value for field, value in zip(STOCK_COLUMNS, row)}
@@ -0,0 +1,152 @@
+import os
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup
+from bs4.builder import HTMLParserTreeBuilder
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+# Extracts the first 9 cells of every #resultsTable tbody row from a
+# symbolhistory page. bs4 and stream return the same list of stripped cell
+# strings as the original BeautifulSoup code, malformed markup included;
+# stream just never builds the tree. lxml matches them on well-formed pages but closes an
+# unclosed <td> where html.parser nests the following cells inside it, so it
+# is only used when asked for.
+
+CELL_COUNT = 9
+PARSER_BACKEND = os.getenv("SCRAPER_PARSER") or "stream"
+# Elements html.parser's tree never leaves open
+VOID_TAGS = frozenset(HTMLParserTreeBuilder().empty_element_tags)
+
+
+def parse_rows_bs4(html):
+    soup = BeautifulSoup(html, "html.parser")
+    table_body = soup.select_one("#resultsTable tbody")
+    if not table_body:
+        return []
+    rows = []
+    for row in table_body.find_all("tr"):
+        row_data = row.find_all("td")
+        if len(row_data) < CELL_COUNT:
+            continue
+        rows.append([cell.text.strip() for cell in row_data[:CELL_COUNT]])
+    return rows
+
+
+def parse_rows_lxml(html):
+    if lxml is None:
+        raise ValueError("The lxml parser backend requires the lxml package")
+    # lxml rejects blank documents, and str pages with an encoding declaration
+    if not html or not html.strip():
+        return []
+    tree = lxml.html.fromstring(html.encode("utf-8") if isinstance(html, str) else html)
+    bodies = tree.xpath('//*[@id="resultsTable"]//tbody')
+    if not bodies:
+        return []
+    rows = []
+    for row in bodies[0].iter("tr"):
+        row_data = list(row.iter("td"))
+        if len(row_data) < CELL_COUNT:
+            continue
+        rows.append([cell.text_content().strip() for cell in row_data[:CELL_COUNT]])
+    return rows
+
+
+class _StopParsing(Exception):
+    pass
+
+
+class ResultsTableParser(HTMLParser):
+    # Event-driven extractor that keeps the same element stack html.parser's
+    # tree would have: an end tag closes the most recent open element of its
+    # name and everything opened inside it, and is ignored if none is open.
+    # The first tbody inside the #resultsTable element is the body; every
+    # <tr> in it is a row whose cells are all the <td>s inside it, nested
+    # ones included, exactly like bs4's find_all. The parse stops when the
+    # body closes.
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self.found_body = False
+        self.stack = []
+        self.results_open = 0
+        self.body = None
+        self.open_rows = []
+        self.open_cells = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            return
+        entry = [tag, any(name == "id" and value == "resultsTable" for name, value in attrs), None]
+        self.stack.append(entry)
+        if self.body is None:
+            if tag == "tbody" and self.results_open:
+                self.body = entry
+                self.found_body = True
+        elif tag == "tr":
+            entry[2] = []
+            self.rows.append(entry[2])
+            self.open_rows.append(entry[2])
+        elif tag == "td":
+            entry[2] = []
+            for row in self.open_rows:
+                row.append(entry[2])
+            self.open_cells.append(entry[2])
+        if entry[1]:
+            self.results_open += 1
+
+    def handle_endtag(self, tag):
+        for depth in range(len(self.stack) - 1, -1, -1):
+            if self.stack[depth][0] == tag:
+                break
+        else:
+            return
+        while len(self.stack) > depth:
+            entry = self.stack.pop()
+            if entry[1]:
+                self.results_open -= 1
+            if entry is self.body:
+                raise _StopParsing()
+            # Elements close innermost first, so theirs is the last one opened
+            if entry[2] is not None:
+                (self.open_rows if entry[0] == "tr" else self.open_cells).pop()
+
+    def handle_data(self, data):
+        for cell in self.open_cells:
+            cell.append(data)
+
+    def result(self):
+        return [["".join(cell).strip() for cell in row[:CELL_COUNT]] for row in self.rows if len(row) >= CELL_COUNT]
+
+
+def parse_rows_stream(html):
+    if isinstance(html, bytes):
+        html = html.decode("utf-8", errors="replace")
+    # The whole page is tokenized: elements left open before the table can
+    # close it, so skipping ahead to it would not match bs4
+    parser = ResultsTableParser()
+    try:
+        parser.feed(html)
+        parser.close()
+    except _StopParsing:
+        pass
+    return parser.result()
+
+
+BACKENDS = {
+    "bs4": parse_rows_bs4,
+    "lxml": parse_rows_lxml,
+    "stream": parse_rows_stream,
+}
+
+
+def parse_results_table(html, backend=None):
+    backend = backend or PARSER_BACKEND
+    try:
+        parse_rows = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown parser backend {backend!r}, expected one of {sorted(BACKENDS)}")
+    return parse_rows(html)